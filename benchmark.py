@@ -0,0 +1,339 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import microtags
+
+
+#
+# _____________________________________________________________________________
+#
+class TraceGenerator(object):
+
+    # Writes deterministic synthetic traces (for a given seed) in the text
+    # format of microtags_flush_text(...). The workload mimics the benchmark
+    # firmware: state data tags followed by a Benchmark span with nested
+    # Start/Update/Finish spans (and context saves within), events, a
+    # vardata digest, dropped stop tags and printf noise between the codes.
+    # The tick counter starts close to its wrap and wraps again after long
+    # idle gaps. Groups in example-groups.json apply to the generated traces.
+
+    tagDefs = [
+            (0x0004, 'start:Benchmark'),
+            (0x0005, 'stop:Benchmark'),
+            (0x0014, 'start:Start'),
+            (0x0015, 'stop:Start'),
+            (0x0016, 'start:Update'),
+            (0x0017, 'stop:Update'),
+            (0x0018, 'start:Finish'),
+            (0x0019, 'stop:Finish'),
+            (0x0021, 'data:BenchSize'),
+            (0x0022, 'data:BenchRun'),
+            (0x0023, 'data:BenchVariant'),
+            (0x0024, 'data:ComprRounds'),
+            (0x0025, 'data:FinalRounds'),
+            (0x0030, 'start:SaveCtxSHA'),
+            (0x0031, 'stop:SaveCtxSHA'),
+            (0x0040, 'event:Yield'),
+            (0x0120, 'vardata:Digest')]
+
+    # benchmark variants (see example-groups.json) and payload sizes
+    variants = [0x10, 0x11, 0x20, 0x21, 0x28, 0x29, 0x30, 0x31, 0x38, 0x40,
+            0x50, 0x60, 0x61]
+    sizes = [16, 32, 64, 128, 256, 512, 1024]
+
+    # probabilities of a dropped stop tag, a noise line and an idle gap
+    dropRate = 0.002
+    noiseRate = 0.01
+    idleRate = 0.0001
+
+    noiseLines = [b'TICK', b'printf: buffer ready', b'  retrying flush ...',
+            b'# comment', b'AAAA*AAA']
+
+    def __init__(self, seed=1):
+        self.seed = seed
+
+    def writeTagDefs(self, f):
+        f.write(''.join(['0x{0:04X}, {1}\n'.format(tagId, idAlias)
+                for tagId, idAlias in self.tagDefs]))
+
+    def iterBenchmarks(self, r):
+
+        # yields the (tag id, data or None for ticks) of one benchmark after
+        # the other, None for a noise line
+
+        run = 0
+        while True:
+            variant = r.choice(self.variants)
+            size = r.choice(self.sizes)
+            tags = [(0x0023, variant), (0x0021, size), (0x0022, run)]
+            if variant >= 0x60:
+                tags += [(0x0024, r.choice([1, 2, 4])), (0x0025, r.choice([2, 3, 4]))]
+            tags += [(0x0004, None), (0x0014, None)]
+            if r.random() < 0.5:
+                tags += [(0x0040, None)]
+            tags += [(0x0015, None)]
+            for k in range(size // 64 + 1):
+                tags += [(0x0016, None), (0x0030, None), (0x0031, None), (0x0017, None)]
+            tags += [(0x0018, None), (0x0019, None)]
+
+            # digest of 16 to 32 bytes in fragments of 3 (first) and 4 bytes
+            digest = bytes(r.getrandbits(8) for i in range(r.randrange(16, 33)))
+            tags += [(0x0120, (len(digest) << 24) | int.from_bytes(digest[:3], 'big'))]
+            tags += [(0x0120, int.from_bytes(digest[i:i + 4].ljust(4, b'\0'), 'big'))
+                    for i in range(3, len(digest), 4)]
+            tags += [(0x0005, None)]
+
+            for tag in tags:
+                if tag[1] is None and tag[0] & 1 and r.random() < self.dropRate:
+                    continue
+                if r.random() < self.noiseRate:
+                    yield None
+                yield tag
+            run = (run + 1) % 10
+
+    def writeTrace(self, f, nTags, blockSize=1 << 16):
+
+        # writes nTags microtags (the last benchmark is cut off) to the binary
+        # file f and returns the number of noise lines written
+
+        r = random.Random(self.seed)
+        ticks = (1 << 32) - 10**6
+        nNoise = 0
+        n = 0
+        records = bytearray()
+        noise = []
+        for tag in self.iterBenchmarks(r):
+            if n == nTags:
+                break
+            if tag is None:
+                # noise goes before the code at this position in the block
+                noise.append((len(records) // 6, r.choice(self.noiseLines)))
+                continue
+            tagId, data = tag
+            if data is None:
+                ticks += r.randrange(50, 5000)
+                if r.random() < self.idleRate:
+                    ticks += r.randrange(1 << 30, 1 << 31)
+                ticks &= 0xFFFFFFFF
+                data = ticks
+            records += data.to_bytes(4, 'big') + tagId.to_bytes(2, 'big')
+            n += 1
+            if len(records) >= 6 * blockSize:
+                nNoise += self.writeBlock(f, records, noise)
+                records = bytearray()
+                noise = []
+        nNoise += self.writeBlock(f, records, noise)
+        return nNoise
+
+    @staticmethod
+    def writeBlock(f, records, noise):
+        # 6 bytes of a record encode to exactly 8 characters of base64
+        codes = base64.b64encode(bytes(records))
+        lines = []
+        last = 0
+        for position, line in noise:
+            lines += [codes[8*i:8*i + 8] for i in range(last, position)] + [line]
+            last = position
+        lines += [codes[8*i:8*i + 8] for i in range(last, len(records) // 6)]
+        if len(lines) > 0:
+            f.write(b'\n'.join(lines) + b'\n')
+        return len(noise)
+
+
+#
+# _____________________________________________________________________________
+#
+def runStages(tagDefFilename, tagsFilename, groupsFilename, stages, repeat):
+
+    # Times the stages of the pipeline on one trace (in a fresh process so
+    # the peak RSS belongs to this trace). Returns stage -> result, keeping
+    # the fastest of repeat runs.
+
+    results = {}
+    for k in range(repeat):
+        microtagList = microtags.MicrotagList()
+        microtagList.importTagDefsFromFile(tagDefFilename)
+        steps = [
+            ('import', lambda: microtagList.importTagsFromFile(tagsFilename)),
+            ('analyse', lambda: microtagList.analyse()),
+            ('str', lambda: str(microtagList)),
+            ('group', lambda: microtags.MicrotagGrouping.fromFile(
+                    groupsFilename).apply(microtagList))]
+        for stage, step in steps:
+            if stage not in stages and stage not in ['import', 'analyse']:
+                continue
+            t = time.perf_counter()
+            step()
+            t = time.perf_counter() - t
+            if stage not in stages:
+                continue
+            n = len(microtagList.tagData)
+            if stage not in results or t < results[stage]['seconds']:
+                results[stage] = {'seconds': t,
+                        'tagsPerSecond': n / t if t > 0 else None,
+                        'peakRssKiB': microtags.MicrotagProfile.getPeakRss()}
+    return results
+
+
+def getCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def resultsToLines(report, baseline=None):
+
+    # table of seconds, tags/s and peak RSS per trace size and stage (and the
+    # speedup over a baseline report of the same sizes and stages)
+
+    before = {}
+    for result in (baseline or {}).get('results', []):
+        for stage, values in result['stages'].items():
+            before[(result['tags'], stage)] = values['seconds']
+
+    header = ['tags', 'stage', 'seconds', 'tags/s', 'peak RSS'] + \
+            ['speedup'] * (baseline is not None)
+    rows = []
+    for result in report['results']:
+        for stage, values in result['stages'].items():
+            row = ['{0:,}'.format(result['tags']), stage,
+                    '{0:.3f}'.format(values['seconds']),
+                    '{0:,.0f}'.format(values['tagsPerSecond'] or 0),
+                    '-' if values['peakRssKiB'] is None else
+                            '{0:,.1f} MiB'.format(values['peakRssKiB'] / 1024.)]
+            if baseline is not None:
+                seconds = before.get((result['tags'], stage))
+                row += ['-' if seconds is None else
+                        '{0:.2f}x'.format(seconds / values['seconds'])]
+            rows += [row]
+
+    widths = [max([len(row[i]) for row in rows + [header]])
+            for i in range(len(header))]
+    return ['  '.join(['{0:{1}}'.format(cell, width) if i == 1 else
+            '{0:>{1}}'.format(cell, width)
+            for i, (cell, width) in enumerate(zip(row, widths))])
+            for row in [header] + rows]
+
+
+#
+# _____________________________________________________________________________
+#
+def main(argv):
+
+    parser = argparse.ArgumentParser(prog='benchmark.py',
+            description='Generate synthetic traces and benchmark microtags.py.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    generateParser = subparsers.add_parser('generate',
+            help='write a synthetic trace and its tag definitions')
+    generateParser.add_argument('tags', type=lambda s: int(float(s)),
+            help='number of microtags (e.g. 1e6)')
+    generateParser.add_argument('tagsFilename', metavar='tag-file')
+    generateParser.add_argument('tagDefFilename', metavar='tag-def-file')
+    generateParser.add_argument('--seed', type=int, default=1)
+
+    runParser = subparsers.add_parser('run',
+            help='time import, analysis, printing and grouping of traces')
+    runParser.add_argument('--sizes', default='1e4,1e5,1e6',
+            help='comma-separated numbers of microtags (up to 1e8)')
+    runParser.add_argument('--stages', default='import,analyse,str,group',
+            help='comma-separated stages to time')
+    runParser.add_argument('--seed', type=int, default=1)
+    runParser.add_argument('--repeat', type=int, default=1,
+            help='keep the fastest of this many runs per stage')
+    runParser.add_argument('--groups', default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'example-groups.json'),
+            help='grouping configuration used by the group stage')
+    runParser.add_argument('--trace-dir', default=None, metavar='DIR',
+            help='keep generated traces in (and reuse them from) this directory')
+    runParser.add_argument('--output', default=None, metavar='FILE',
+            help='store the results as JSON')
+    runParser.add_argument('--baseline', default=None, metavar='FILE',
+            help='JSON results of an earlier run to compare against')
+
+    args = parser.parse_args(argv)
+    generator = TraceGenerator(args.seed)
+
+    if args.command == 'generate':
+        with open(args.tagDefFilename, 'w') as f:
+            generator.writeTagDefs(f)
+        with open(args.tagsFilename, 'wb') as f:
+            nNoise = generator.writeTrace(f, args.tags)
+        print('Wrote {0} microtag(s) and {1} noise line(s).'.format(args.tags, nNoise))
+        return
+
+    sizes = [int(float(size)) for size in args.sizes.split(',')]
+    stages = args.stages.split(',')
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    # every trace is timed in a fresh process (peak RSS is per process)
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    traceDir = args.trace_dir or tempfile.mkdtemp(prefix='microtags-bench-')
+    os.makedirs(traceDir, exist_ok=True)
+    tagDefFilename = os.path.join(traceDir, 'tag-defs.txt')
+    with open(tagDefFilename, 'w') as f:
+        generator.writeTagDefs(f)
+
+    report = {
+        'commit': getCommit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': microtags.haveNumpy() and microtags.numpy.__version__ or None,
+        'seed': args.seed,
+        'results': []}
+
+    try:
+        for size in sizes:
+            tagsFilename = os.path.join(traceDir,
+                    'trace-{0}-{1}.txt'.format(args.seed, size))
+            if not os.path.exists(tagsFilename):
+                print('Generating {0:,} microtag(s) ...'.format(size))
+                with open(tagsFilename + '.tmp', 'wb') as f:
+                    generator.writeTrace(f, size)
+                os.replace(tagsFilename + '.tmp', tagsFilename)
+            print('Benchmarking {0:,} microtag(s) ...'.format(size))
+            with ProcessPoolExecutor(1, multiprocessing.get_context('spawn')) as pool:
+                results = pool.submit(runStages, tagDefFilename, tagsFilename,
+                        args.groups, stages, args.repeat).result()
+            report['results'].append({'tags': size,
+                    'traceBytes': os.path.getsize(tagsFilename),
+                    'stages': results})
+    finally:
+        if args.trace_dir is None:
+            shutil.rmtree(traceDir)
+
+    print('\n'.join(resultsToLines(report, baseline)))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print('Saved results to {0}.'.format(args.output))
+
+    return report
+
+
+#
+# _____________________________________________________________________________
+#
+if __name__ == "__main__":
+    main(sys.argv[1:]);
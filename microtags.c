@@ -40,6 +40,33 @@ static microtag_t* microtags_buffer = 0;
 /* the length of the microtags buffer in units of one microtrag */
 static int microtags_buffer_length_n_tags = 0;
 
+#ifndef MICROTAGS_BINARY_BLOCK_SIZE
+    /* number of bytes passed to the send function at once by binary flushes */
+    #define MICROTAGS_BINARY_BLOCK_SIZE 64
+#endif
+
+#ifndef MICROTAGS_BINARY_FRAME_N_TAGS
+    /* maximum number of microtags in a single binary frame */
+    #define MICROTAGS_BINARY_FRAME_N_TAGS 256
+#endif
+
+/* a block of bytes being assembled by a binary flush */
+typedef struct {
+
+    /* function to send out the block once it is full */
+    microtags_f_send_bytes_t f_send_bytes;
+
+    /* the bytes of the block */
+    uint8_t bytes[MICROTAGS_BINARY_BLOCK_SIZE];
+
+    /* the number of bytes in the block */
+    uint_fast16_t n_bytes;
+
+    /* CRC-16 (polynomial 0x1021, initial value 0) of the current frame */
+    uint_fast16_t crc;
+
+} microtags_block_t;
+
 
 /*
  * Function to set a ticks-based microtag (writes one microtag to the buffer)
@@ -189,6 +216,163 @@ void microtags_flush_text(microtags_f_send_byte_t microtags_f_send_byte) {
 }
 
 
+/*
+ * Function to append a byte to a block (sending out the block once it is full)
+ * ___________________________________________________________________________
+ */
+static void microtags_block_put(microtags_block_t* block, uint8_t byte) {
+
+    block->bytes[block->n_bytes++] = byte;
+
+    if (block->n_bytes == MICROTAGS_BINARY_BLOCK_SIZE) {
+        (*block->f_send_bytes)(block->bytes, block->n_bytes);
+        block->n_bytes = 0;
+    }
+}
+
+
+/*
+ * Function to append a byte to a block and to the CRC of the current frame
+ * ___________________________________________________________________________
+ */
+static void microtags_block_put_crc(microtags_block_t* block, uint8_t byte) {
+
+    uint_fast8_t i;
+
+    block->crc ^= (uint_fast16_t)byte << 8;
+    for (i = 0; i < 8; i++) {
+        if (block->crc & 0x8000) {
+            block->crc = (block->crc << 1) ^ 0x1021;
+        } else {
+            block->crc <<= 1;
+        }
+    }
+    block->crc &= 0xFFFF;
+
+    microtags_block_put(block, byte);
+}
+
+
+/*
+ * Function to determine the number of bytes of a value encoded as varint
+ * ___________________________________________________________________________
+ */
+static uint_fast8_t microtags_varint_length(uint_fast32_t value) {
+
+    uint_fast8_t length = 1;
+
+    while (value >= 0x80) {
+        value >>= 7;
+        length++;
+    }
+
+    return length;
+}
+
+
+/*
+ * Function to send out all microtags from the buffer in binary frames and clear the buffer
+ *
+ * Every frame consists of the sync bytes 0xA5 0x5A, a flags byte, the
+ * payload length (16 bits, big endian), the payload and a CRC-16 (big endian,
+ * polynomial 0x1021, initial value 0) over flags, length and payload. The
+ * payload holds one record per microtag: either data (32 bits) and id (16
+ * bits), both big endian, or, with MICROTAGS_BINARY_DELTA, the id followed
+ * by the difference of data to the previous record of the frame as varint
+ * (7 bits per byte, least-significant group first).
+ * ___________________________________________________________________________
+ */
+void microtags_flush_binary(microtags_f_send_bytes_t microtags_f_send_bytes, uint_fast8_t flags) {
+
+    microtags_block_t   block;
+    uint_fast32_t       data;
+    uint_fast32_t       previous;
+    uint_fast32_t       value;
+    uint_fast16_t       id;
+    uint_fast16_t       first;
+    uint_fast16_t       n;
+    uint_fast16_t       i;
+    uint_fast16_t       length;
+
+    if (microtags_f_send_bytes == 0) {
+        return;
+    }
+
+    block.f_send_bytes = microtags_f_send_bytes;
+    block.n_bytes = 0;
+
+    /* iterate over all microtags in the buffer, frame by frame */
+    for (first = 0; first < microtags_n_tags_in_buffer; first += n) {
+
+        n = microtags_n_tags_in_buffer - first;
+        if (n > MICROTAGS_BINARY_FRAME_N_TAGS) {
+            n = MICROTAGS_BINARY_FRAME_N_TAGS;
+        }
+
+        /* determine the length of the payload */
+        if (flags & MICROTAGS_BINARY_DELTA) {
+            length = 0;
+            previous = 0;
+            for (i = first; i < first + n; ++i) {
+                length += 2 + microtags_varint_length(
+                        (microtags_buffer[i].data - previous) & 0xFFFFFFFF);
+                previous = microtags_buffer[i].data;
+            }
+        } else {
+            length = 6 * n;
+        }
+
+        /* frame header */
+        microtags_block_put(&block, 0xA5);
+        microtags_block_put(&block, 0x5A);
+        block.crc = 0;
+        microtags_block_put_crc(&block, flags);
+        microtags_block_put_crc(&block, (length >> 8) & 0xFF);
+        microtags_block_put_crc(&block, length & 0xFF);
+
+        /* payload */
+        previous = 0;
+        for (i = first; i < first + n; ++i) {
+
+            data = microtags_buffer[i].data;
+            id = microtags_buffer[i].id;
+
+            if (flags & MICROTAGS_BINARY_DELTA) {
+                microtags_block_put_crc(&block, (id >> 8) & 0xFF);
+                microtags_block_put_crc(&block, id & 0xFF);
+                value = (data - previous) & 0xFFFFFFFF;
+                while (value >= 0x80) {
+                    microtags_block_put_crc(&block, (value & 0x7F) | 0x80);
+                    value >>= 7;
+                }
+                microtags_block_put_crc(&block, value);
+                previous = data;
+            } else {
+                microtags_block_put_crc(&block, (data >> 24) & 0xFF);
+                microtags_block_put_crc(&block, (data >> 16) & 0xFF);
+                microtags_block_put_crc(&block, (data >> 8) & 0xFF);
+                microtags_block_put_crc(&block, data & 0xFF);
+                microtags_block_put_crc(&block, (id >> 8) & 0xFF);
+                microtags_block_put_crc(&block, id & 0xFF);
+            }
+        }
+
+        /* frame trailer (the CRC is sent after the bytes it covers) */
+        id = block.crc;
+        microtags_block_put(&block, (id >> 8) & 0xFF);
+        microtags_block_put(&block, id & 0xFF);
+    }
+
+    /* send out the remaining bytes */
+    if (block.n_bytes > 0) {
+        (*block.f_send_bytes)(block.bytes, block.n_bytes);
+    }
+
+    /* clear the buffer */
+    microtags_clear();
+}
+
+
 /*
  * Function to clear the buffer
  * ___________________________________________________________________________
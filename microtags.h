@@ -42,6 +42,12 @@ typedef struct {
 /* definition of function pointer to send out a single byte */
 typedef void (*microtags_f_send_byte_t)(uint8_t byte);
 
+/* definition of function pointer to send out a block of bytes */
+typedef void (*microtags_f_send_bytes_t)(const uint8_t* bytes, uint_fast16_t length);
+
+/* flag for binary flushes: encode data as difference to the previous microtag */
+#define MICROTAGS_BINARY_DELTA 0x01
+
 /* Function to init the microtags buffer */
 void microtags_init(microtag_t* buffer, int buffer_length_n_tags);
 
@@ -57,6 +63,9 @@ void microtags_set_with_vardata(uint_fast16_t id, uint8_t* data, uint_fast8_t le
 /* Function to send out all microtags from the buffer and clear the buffer */
 void microtags_flush_text(microtags_f_send_byte_t microtags_f_send_byte);
 
+/* Function to send out all microtags from the buffer in binary frames and clear the buffer */
+void microtags_flush_binary(microtags_f_send_bytes_t microtags_f_send_bytes, uint_fast8_t flags);
+
 /* Function to clear the buffer */
 void microtags_clear(void);
 
@@ -1,8 +1,46 @@
 #!/usr/bin/python3
 
+import os
+import re
 import sys
+import glob
+import json
+import math
+import mmap
+import stat
+import string
 import base64
+import bisect
+import hashlib
+import io
+import time
+import importlib
+import tempfile
+import argparse
 import binascii
+from array import array
+
+# numpy is optional and imported on first use (see haveNumpy()). Until then,
+# it is only imported for blocks large enough to make up for the time the
+# import takes, so that quick inspections start fast.
+numpy = None
+numpyImported = None
+numpyMinSize = 1 << 16
+
+
+def haveNumpy(size=None):
+    # True if numpy can be used (for a block of the given size)
+    global numpy, numpyImported
+    if numpyImported is None:
+        if size is not None and size < numpyMinSize:
+            return False
+        try:
+            import numpy as module
+            numpy = module
+            numpyImported = True
+        except ImportError:
+            numpyImported = False
+    return numpy is not None
 
 
 #
@@ -85,6 +123,8 @@ class TextFormatter(object):
 #
 class Microtag(object):
 
+    __slots__ = ('tagData', 'tagId')
+
     def __init__(self, microtag=None):
         if microtag is None:
             self.tagData = None
@@ -111,13 +151,485 @@ class Microtag(object):
             raise Exception('Invalid code "{0}"'.format(code))
 
         # extract data and id from base64-encoded tag
-        hexCode = binascii.hexlify(base64.b64decode(code))
-        self.tagData = int(hexCode[0:8], base = 16)
-        self.tagId = int(hexCode[8:12], base = 16)
+        tagData, tagIds, invalid = MicrotagDecoder.decodeCodes([code])
+        if len(invalid) > 0:
+            raise Exception('Invalid code "{0}"'.format(code))
+        self.tagData = tagData[0]
+        self.tagId = tagIds[0]
 
     def exportCode(self):
         hexCode = '{0:08X}{1:04X}'.format(self.tagData, self.tagId)
-        return hexCode.encode('base64')
+        return base64.b64encode(binascii.unhexlify(hexCode)).decode('ascii')
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagHeadStream(io.RawIOBase):
+
+    # Raw stream returning the bytes already read from binary stream f (the
+    # head, e.g. to look at the magic number of a pipe) before the rest of f
+
+    def __init__(self, head, f):
+        io.RawIOBase.__init__(self)
+        self.head = head
+        self.f = f
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if len(self.head) > 0:
+            n = min(len(b), len(self.head))
+            b[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        return self.f.readinto1(b)
+
+    def close(self):
+        if not self.closed:
+            self.f.close()
+        io.RawIOBase.close(self)
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagDecoder(object):
+
+    # default number of bytes read from trace files at once
+    chunkSize = 1 << 20
+
+    # magic numbers of compressed trace files and the modules reading them
+    compressions = [
+            (b'\x1f\x8b', 'gzip'),
+            (b'\xfd7zXZ\x00', 'lzma'),
+            (b'BZh', 'bz2')]
+
+    # sync bytes and flags of frames sent by microtags_flush_binary(...)
+    frameSync = b'\xA5\x5A'
+    FRAME_DELTA = 0x01
+
+    # longest payload of a frame: MICROTAGS_BINARY_FRAME_N_TAGS (256) delta
+    # records of a 16-bit id and a varint of up to 5 bytes (a longer length
+    # field can only follow a false sync)
+    maxFramePayload = 256 * 7
+
+    # the base64 alphabet used by microtags_flush_text(...)
+    alphabet = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+    # lookup table from ASCII characters to 6-bit values (0xFF = invalid)
+    lookupTable = None
+
+    @staticmethod
+    def getLookupTable():
+        if MicrotagDecoder.lookupTable is None:
+            table = numpy.full(256, 0xFF, dtype=numpy.uint8)
+            table[numpy.frombuffer(MicrotagDecoder.alphabet, dtype=numpy.uint8)] = \
+                    numpy.arange(64, dtype=numpy.uint8)
+            MicrotagDecoder.lookupTable = table
+        return MicrotagDecoder.lookupTable
+
+    @staticmethod
+    def decodeCodes(codes):
+
+        # Decodes a block of 8-character base64 codes in one go and returns
+        # the tuple (tagData, tagIds, invalid) with tagData being an
+        # array('I') of 32-bit data words, tagIds being an array('H') of
+        # 16-bit ids and invalid being the list of codes that were skipped
+
+        codes = [c.encode('ascii', 'replace') if isinstance(c, str) else c
+                for c in codes]
+
+        # codes need to be exactly 8 characters long
+        invalid = [c for c in codes if len(c) != 8]
+        if len(invalid) > 0:
+            codes = [c for c in codes if len(c) == 8]
+
+        block = b''.join(codes)
+
+        if haveNumpy(len(block)):
+            tagData, tagIds, valid = MicrotagDecoder.decodeBlockNumpy(block)
+            if not valid.all():
+                invalid += [codes[i] for i in numpy.flatnonzero(~valid)]
+        else:
+            if len(block.translate(None, MicrotagDecoder.alphabet)) > 0:
+                # >>> at least one code with non-base64 characters >>>
+                invalid += [c for c in codes
+                        if len(c.translate(None, MicrotagDecoder.alphabet)) > 0]
+                block = b''.join([c for c in codes
+                        if len(c.translate(None, MicrotagDecoder.alphabet)) == 0])
+            tagData, tagIds = MicrotagDecoder.decodeBlock(block)
+
+        return tagData, tagIds, [c.decode('ascii', 'replace') for c in invalid]
+
+    @staticmethod
+    def iterBuffers(f, chunkSize=None):
+
+        # Reads binary file object f (or an mmap) in chunks and yields them
+        # as bytes ending at a newline (except for the last one)
+
+        if chunkSize is None:
+            chunkSize = MicrotagDecoder.chunkSize
+
+        rest = b''
+        while True:
+            chunk = f.read(chunkSize)
+            if len(chunk) == 0:
+                break
+            if len(rest) > 0:
+                chunk = rest + chunk
+            end = chunk.rfind(b'\n') + 1
+            rest = chunk[end:]
+            if end > 0:
+                yield chunk[:end]
+        if len(rest) > 0:
+            yield rest
+
+    @staticmethod
+    def getCompression(filename):
+        # module decompressing a trace file, recognised by the magic number
+        # at its beginning (None for uncompressed files and stdin)
+        if filename == '-':
+            return None
+        with open(filename, 'rb') as f:
+            head = f.read(6)
+        for magic, module in MicrotagDecoder.compressions:
+            if head.startswith(magic):
+                return module
+        return None
+
+    @staticmethod
+    def openTrace(filename):
+
+        # Opens a trace file for reading bytes ('-' for stdin, which is left
+        # open on close). Files compressed with gzip, xz or bzip2 are
+        # decompressed block by block while they are read.
+
+        if filename == '-':
+            # read the complete magic number (peek(...) may return less on a
+            # pipe) and hand it out again in front of the rest of stdin
+            f = open(sys.stdin.fileno(), 'rb', closefd=False)
+            head = f.read(6)
+            f = io.BufferedReader(MicrotagHeadStream(head, f))
+            for magic, module in MicrotagDecoder.compressions:
+                if head.startswith(magic):
+                    return importlib.import_module(module).open(f, 'rb')
+            return f
+
+        module = MicrotagDecoder.getCompression(filename)
+        if module is None:
+            return open(filename, 'rb')
+        return importlib.import_module(module).open(filename, 'rb')
+
+    @staticmethod
+    def isSeekable(filename):
+        # True if the trace can be split or mapped (an uncompressed file)
+        return filename != '-' and MicrotagDecoder.getCompression(filename) is None
+
+    @staticmethod
+    def splitFile(filename, nParts):
+
+        # Returns a list of (begin, end) byte ranges covering the file, with
+        # every range starting right after a newline
+
+        size = os.path.getsize(filename)
+        bounds = [0]
+        with open(filename, 'rb') as f:
+            for i in range(1, nParts):
+                f.seek(max(size * i // nParts, bounds[-1]))
+                f.readline()
+                if f.tell() < size and f.tell() > bounds[-1]:
+                    bounds += [f.tell()]
+        bounds += [size]
+        return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+    @staticmethod
+    def iterCodeBlocks(filename, chunkSize=None, useMmap=False, extractor=None):
+
+        # Yields (tagData, tagIds) for every chunk of a trace file, using a
+        # MicrotagExtractor to find the codes (by default: lines of exactly
+        # 8 base64 characters)
+
+        if extractor is None:
+            extractor = MicrotagExtractor()
+
+        with MicrotagDecoder.openTrace(filename) as f:
+            source = f
+            if useMmap and filename != '-' and isinstance(f, io.BufferedReader) \
+                    and os.fstat(f.fileno()).st_size > 0:
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for buffer in MicrotagDecoder.iterBuffers(source, chunkSize):
+                    yield extractor.extract(buffer)
+            finally:
+                if source is not f:
+                    source.close()
+
+    @staticmethod
+    def decodeBlock(block):
+        # decode all 6-byte records at once (no newlines, no invalid codes)
+        return MicrotagDecoder.decodeRecords(base64.b64decode(block))
+
+    @staticmethod
+    def decodeRecords(raw):
+
+        # decode 6-byte records (32-bit data and 16-bit id, both big endian)
+        n = len(raw) // 6
+        raw = bytes(raw)
+
+        # scatter big-endian record bytes into the data and id columns
+        dataBytes = bytearray(4*n)
+        idBytes = bytearray(2*n)
+        for i in range(4):
+            dataBytes[i::4] = raw[i::6]
+        for i in range(2):
+            idBytes[i::2] = raw[4 + i::6]
+
+        # array('I') and array('H') are 32 and 16 bits on all supported platforms
+        tagData = array('I', bytes(dataBytes))
+        tagIds = array('H', bytes(idBytes))
+        if sys.byteorder == 'little':
+            tagData.byteswap()
+            tagIds.byteswap()
+
+        return tagData, tagIds
+
+    @staticmethod
+    def decodeBlockNumpy(block):
+
+        # map every character of the block to its 6-bit value
+        values = MicrotagDecoder.getLookupTable()[
+                numpy.frombuffer(block, dtype=numpy.uint8)].reshape(-1, 8)
+        valid = (values < 64).all(axis=1)
+        values = values[valid].astype(numpy.uint64)
+
+        # combine 8 x 6 bits into one 48-bit record (32-bit data, 16-bit id)
+        shifts = numpy.arange(42, -1, -6, dtype=numpy.uint64)
+        records = numpy.bitwise_or.reduce(values << shifts, axis=1)
+
+        # the columns are copied once into the arrays
+        tagData = array('I')
+        tagData.frombytes(memoryview(
+                (records >> numpy.uint64(16)).astype(numpy.uint32)).cast('B'))
+        tagIds = array('H')
+        tagIds.frombytes(memoryview(
+                (records & numpy.uint64(0xFFFF)).astype(numpy.uint16)).cast('B'))
+
+        return tagData, tagIds, valid
+
+    @staticmethod
+    def decodeRecordsNumpy(raw):
+        # decode 6-byte records read in place from raw (converted to native
+        # byte order and copied once into the arrays)
+        records = numpy.frombuffer(raw, dtype=[('data', '>u4'), ('id', '>u2')])
+        tagData = array('I')
+        tagData.frombytes(memoryview(records['data'].astype(numpy.uint32)).cast('B'))
+        tagIds = array('H')
+        tagIds.frombytes(memoryview(records['id'].astype(numpy.uint16)).cast('B'))
+        return tagData, tagIds
+
+    @staticmethod
+    def decodeDeltaRecords(raw):
+
+        # decode records of a 16-bit id (big endian) followed by the
+        # difference to the previous data as varint
+        tagData = array('I')
+        tagIds = array('H')
+        data = 0
+        pos = 0
+        while pos < len(raw):
+            tagIds.append((raw[pos] << 8) | raw[pos + 1])
+            pos += 2
+            value = 0
+            shift = 0
+            while True:
+                byte = raw[pos]
+                pos += 1
+                value |= (byte & 0x7F) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            data = (data + value) & 0xFFFFFFFF
+            tagData.append(data)
+        return tagData, tagIds
+
+    @staticmethod
+    def decodeFrames(buffer, final=False):
+
+        # Decodes the frames of binary flushes (see microtags_flush_binary(...))
+        # in buffer and returns (tagData, tagIds, consumed, nBadFrames) with
+        # consumed being the number of bytes up to the first incomplete frame.
+        # With final set, incomplete frames are taken as bad ones.
+
+        view = memoryview(buffer)
+        tagData = array('I')
+        tagIds = array('H')
+        nBadFrames = 0
+
+        pos = 0
+        while True:
+            start = buffer.find(MicrotagDecoder.frameSync, pos)
+            if start < 0:
+                # keep a trailing byte that might start the next sync
+                consumed = len(buffer)
+                if not final and len(buffer) > pos and \
+                        buffer[-1] == MicrotagDecoder.frameSync[0]:
+                    consumed -= 1
+                break
+
+            end = start + 7
+            if end <= len(buffer):
+                length = int.from_bytes(buffer[start + 3:start + 5], byteorder='big')
+                if length > MicrotagDecoder.maxFramePayload:
+                    # >>> false sync, resync instead of waiting for the frame >>>
+                    nBadFrames += 1
+                    pos = start + 1
+                    continue
+                end += length
+            if end > len(buffer):
+                if final:
+                    nBadFrames += 1
+                    pos = start + 1
+                    continue
+                consumed = start
+                break
+
+            flags = buffer[start + 2]
+            payload = view[start + 5:end - 2]
+            if binascii.crc_hqx(view[start + 2:end - 2], 0) != \
+                    int.from_bytes(buffer[end - 2:end], byteorder='big'):
+                # >>> corrupted frame or false sync >>>
+                nBadFrames += 1
+                pos = start + 1
+                continue
+
+            try:
+                if flags & MicrotagDecoder.FRAME_DELTA:
+                    data, ids = MicrotagDecoder.decodeDeltaRecords(payload)
+                elif haveNumpy(len(payload)):
+                    data, ids = MicrotagDecoder.decodeRecordsNumpy(payload)
+                else:
+                    data, ids = MicrotagDecoder.decodeRecords(payload)
+            except (IndexError, ValueError):
+                nBadFrames += 1
+                pos = start + 1
+                continue
+
+            tagData.extend(data)
+            tagIds.extend(ids)
+            pos = end
+
+        view.release()
+        return tagData, tagIds, consumed, nBadFrames
+
+    @staticmethod
+    def iterFrameBlocks(f, chunkSize=None):
+
+        # Reads binary flushes from binary file object f in chunks and yields
+        # (tagData, tagIds, nBadFrames) per chunk
+
+        if chunkSize is None:
+            chunkSize = MicrotagDecoder.chunkSize
+
+        rest = b''
+        while True:
+            chunk = f.read(chunkSize)
+            final = len(chunk) == 0
+            buffer = rest + chunk if len(rest) > 0 else chunk
+            tagData, tagIds, consumed, nBadFrames = \
+                    MicrotagDecoder.decodeFrames(buffer, final)
+            rest = buffer[consumed:]
+            yield tagData, tagIds, nBadFrames
+            if final:
+                break
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagExtractor(object):
+
+    # Finds microtag codes in text buffers (e.g. console logs with printf
+    # debugging mixed in) with a single compiled regular expression scan.
+    # With a prefix (see MICROTAGS_TEXT_PREFIX) a code may appear anywhere
+    # in a line after the prefix; without one, a line has to consist of the
+    # code only. A custom pattern needs one group capturing the code.
+
+    def __init__(self, prefix=None, pattern=None):
+        if isinstance(prefix, str):
+            prefix = prefix.encode('ascii')
+        if isinstance(pattern, str):
+            pattern = pattern.encode('ascii')
+        self.prefix = prefix if prefix else None
+
+        if self.prefix is not None:
+            lead = re.escape(self.prefix)
+        else:
+            lead = rb'^[ \t]*'
+
+        self.customPattern = pattern is not None
+        if pattern is None:
+            pattern = lead + rb'([A-Za-z0-9+/]{8})[ \t\r]*$'
+        self.pattern = re.compile(pattern, re.MULTILINE)
+        if self.pattern.groups != 1:
+            raise ValueError('Pattern "{0}" has {1} groups instead of one capturing '
+                    'the microtag'.format(pattern.decode('ascii', 'replace'),
+                            self.pattern.groups))
+
+        # lines that look like carrying a microtag (to count malformed ones),
+        # a custom pattern finds exactly these lines
+        if self.prefix is None and not self.customPattern:
+            self.candidatePattern = re.compile(
+                    rb'^[ \t]*[^#\s]\S{7}[ \t\r]*$', re.MULTILINE)
+        else:
+            self.candidatePattern = None
+
+        # statistics
+        self.nLines = 0
+        self.nCodes = 0
+        self.nMalformed = 0
+
+    def getNumberOfLines(self):
+        return self.nLines
+
+    def getNumberOfCodes(self):
+        return self.nCodes
+
+    def getNumberOfMalformedLines(self):
+        return self.nMalformed
+
+    def getNumberOfSkippedLines(self):
+        return self.nLines - self.nCodes - self.nMalformed
+
+    def extract(self, buffer):
+
+        # returns (tagData, tagIds) of all microtags found in the buffer
+
+        codes = self.pattern.findall(buffer)
+
+        if self.customPattern:
+            # codes matched by the pattern which fail to decode are malformed
+            nCandidates = len(codes)
+        elif self.prefix is not None:
+            nCandidates = buffer.count(self.prefix)
+        else:
+            nCandidates = len(self.candidatePattern.findall(buffer))
+
+        if self.customPattern:
+            tagData, tagIds, invalid = MicrotagDecoder.decodeCodes(codes)
+        elif haveNumpy(len(buffer)):
+            tagData, tagIds, valid = MicrotagDecoder.decodeBlockNumpy(b''.join(codes))
+        else:
+            tagData, tagIds = MicrotagDecoder.decodeBlock(b''.join(codes))
+
+        self.nLines += buffer.count(b'\n')
+        if len(buffer) > 0 and buffer[-1:] != b'\n':
+            self.nLines += 1
+        self.nCodes += len(tagData)
+        self.nMalformed += max(nCandidates - len(codes), 0) + len(codes) - len(tagData)
+
+        return tagData, tagIds
 
 
 #
@@ -125,6 +637,8 @@ class Microtag(object):
 #
 class MicrotagUntyped(Microtag):
 
+    __slots__ = ('idAlias', 'index')
+
     def __init__(self, tag=None, idAlias=None):
         Microtag.__init__(self, tag)
         self.idAlias = idAlias
@@ -148,6 +662,8 @@ class MicrotagUntyped(Microtag):
 #
 class MicrotagTickBased(MicrotagUntyped):
 
+    __slots__ = ()
+
     def __init__(self, tag=None, idAlias=None):
         MicrotagUntyped.__init__(self, tag, idAlias)
 
@@ -157,6 +673,8 @@ class MicrotagTickBased(MicrotagUntyped):
 #
 class MicrotagStart(MicrotagTickBased):
 
+    __slots__ = ('stopTagIndex',)
+
     def __init__(self, tag=None, idAlias=None):
         MicrotagTickBased.__init__(self, tag, idAlias)
         self.stopTagIndex = None
@@ -173,6 +691,8 @@ class MicrotagStart(MicrotagTickBased):
 #
 class MicrotagStop(MicrotagTickBased):
 
+    __slots__ = ('startTagIndex',)
+
     def __init__(self, tag=None, idAlias=None):
         MicrotagTickBased.__init__(self, tag, idAlias)
         self.startTagIndex = None
@@ -189,6 +709,8 @@ class MicrotagStop(MicrotagTickBased):
 #
 class MicrotagEvent(MicrotagTickBased):
 
+    __slots__ = ()
+
     def __init__(self, tag=None, idAlias=None):
         MicrotagTickBased.__init__(self, tag, idAlias)
 
@@ -198,6 +720,8 @@ class MicrotagEvent(MicrotagTickBased):
 #
 class MicrotagData(MicrotagUntyped):
 
+    __slots__ = ()
+
     def __init__(self, tag=None, idAlias=None):
         MicrotagUntyped.__init__(self, tag, idAlias)
 
@@ -207,27 +731,32 @@ class MicrotagData(MicrotagUntyped):
 #
 class MicrotagVarData(MicrotagData):
 
+    __slots__ = ('fragmentIndex', 'length', 'payload', 'isLast')
+
     def __init__(self, tag=None, idAlias=None):
         MicrotagData.__init__(self, tag, idAlias)
-        self.previous = None
+        self.fragmentIndex = 0
         self.length = None
-        self.data = None
+        self.payload = None
         self.isLast = False
 
-    def setPrevious(self, previous):
-        self.previous = previous
+    def setFragment(self, fragmentIndex, length, payload):
+        # fragment 0 carries up to 3 bytes (after the length byte),
+        # every further fragment carries up to 4 bytes
+        self.fragmentIndex = fragmentIndex
+        self.length = length
+        self.payload = payload
+        self.isLast = len(payload) >= length and self.getEnd() >= length
 
     def getIndex(self):
-        if self.previous is None:
-            return 0
-        else:
-            return self.previous.getIndex() + 1
+        return self.fragmentIndex
 
     def getLength(self):
-        if self.previous is None:
-            return self.length
-        else:
-            return self.previous.getLength()
+        return self.length
+
+    def getEnd(self):
+        # offset into the payload right after the last byte of this fragment
+        return min(self.length, 4*self.fragmentIndex + 3)
 
     def setIsLast(self, isLast):
         self.isLast = isLast
@@ -235,307 +764,3359 @@ class MicrotagVarData(MicrotagData):
     def getIsLast(self):
         return self.isLast
 
+    def getPayload(self):
+        return self.payload
+
     def getData(self):
-        if self.previous is None:
-            return self.data
-        else:
-            return self.previous.getData() + self.data
+        # payload data up to and including this fragment
+        return self.payload[:self.getEnd()]
 
-    def processVarData(self):
-        if self.getIndex() == 0:
-            self.length = (self.getTagData() & 0xFF000000) >> 24
-            self.data = (self.getTagData() & 0x00FFFFFF) \
-                    .to_bytes(3, byteorder='big')[:self.length]
-        else:
-            self.data = self.getTagData().to_bytes(4, byteorder='big') \
-                    [:self.getLength() - 4*self.getIndex()]
-            if self.getLength() - 4*self.getIndex() < 4:
-                self.setIsLast(True)
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagType(object):
+
+    # type codes of analysed microtags (as stored in MicrotagList.tagTypes)
+    UNTYPED = 0
+    START = 1
+    STOP = 2
+    EVENT = 3
+    DATA = 4
+    VARDATA = 5
+
+    # tag definition prefixes and the type codes they map to
+    prefixes = [
+            ('start:', START),
+            ('stop:', STOP),
+            ('event:', EVENT),
+            ('data:', DATA),
+            ('vardata:', VARDATA)]
+
+    # classes used to present analysed microtags of a certain type
+    classes = {
+            UNTYPED: MicrotagUntyped,
+            START: MicrotagStart,
+            STOP: MicrotagStop,
+            EVENT: MicrotagEvent,
+            DATA: MicrotagData,
+            VARDATA: MicrotagVarData}
+
+    # names used by the machine-readable renderers
+    names = {
+            UNTYPED: 'untyped',
+            START: 'start',
+            STOP: 'stop',
+            EVENT: 'event',
+            DATA: 'data',
+            VARDATA: 'vardata'}
+
+    @staticmethod
+    def parseIdAlias(idAlias):
+        # split a tag definition into its type code and the bare alias
+        for prefix, tagType in MicrotagType.prefixes:
+            if idAlias.startswith(prefix):
+                return tagType, idAlias[len(prefix):]
+        return MicrotagType.UNTYPED, idAlias
 
 
 #
 # _____________________________________________________________________________
 #
-class MicrotagList(object):
+class MicrotagDispatchTable(object):
 
-    def __init__(self, dataToTime=None):
-        self.rawTags = []
-        self.analysedTags = None
-        self.tagDefDict = {}
+    # Tag definitions compiled into two dense tables indexed by the 16-bit
+    # tag id: the type code and the alias index of every id (UNTYPED and -1
+    # for undefined ids). Aliases are numbered in the order of the tag
+    # definitions, so that analysers working on different parts of a trace
+    # agree on them. Problems found while compiling are collected as
+    # warnings rather than raised.
 
-        # conversion function from data (ticks) to time
-        if dataToTime is not None:
-            self.dataToTime = dataToTime
-        else:
-            # the default is using ticks
-            self.dataToTime = lambda c: (c, 'ticks', 0)
+    nIds = 1 << 16
 
-    def dataToTimeStr(self, data):
-        time = self.dataToTime(data)
-        return '{0:,.{2}f} {1}'.format(time[0], time[1], time[2]) 
+    def __init__(self, tagDefDict):
+        self.tagTypes = array('B', bytes(MicrotagDispatchTable.nIds))
+        self.aliasIndices = array('i', [-1]) * MicrotagDispatchTable.nIds
+        self.aliases = []
+        self.warnings = []
+        self.numpyTables = None
 
-    def dataToTimeDiffStr(self, dataStart, dataStop):
-        timeStart = self.dataToTime(dataStart)
-        timeStop = self.dataToTime(dataStop)
-        return '{0:,.{2}f} {1}'.format(
-                timeStop[0] - timeStart[0], timeStop[1], timeStop[2])
+        aliasIndexDict = {}
+        aliasTypes = {}
+        for tagId, tagDef in tagDefDict.items():
+            if not 0 <= tagId < MicrotagDispatchTable.nIds:
+                self.warnings += ['Tag id 0x{0:X} of "{1}" is out of range'
+                        .format(tagId, tagDef)]
+                continue
+            tagType, idAlias = MicrotagType.parseIdAlias(tagDef)
+            if tagType == MicrotagType.UNTYPED and \
+                    re.match(r'^\w+:', idAlias) is not None:
+                self.warnings += ['Unknown type prefix in "{0}" (tag id 0x{1:04X})'
+                        .format(tagDef, tagId)]
+            if idAlias not in aliasIndexDict:
+                aliasIndexDict[idAlias] = len(self.aliases)
+                self.aliases.append(idAlias)
+            self.tagTypes[tagId] = tagType
+            self.aliasIndices[tagId] = aliasIndexDict[idAlias]
+            aliasTypes.setdefault(idAlias, set()).add(tagType)
 
-    def getRawTags(self):
-        return self.rawTags
+        for idAlias in self.aliases:
+            types = aliasTypes[idAlias]
+            if MicrotagType.START in types and MicrotagType.STOP not in types:
+                self.warnings += ['Start tag "{0}" has no stop tag'.format(idAlias)]
+            elif MicrotagType.STOP in types and MicrotagType.START not in types:
+                self.warnings += ['Stop tag "{0}" has no start tag'.format(idAlias)]
 
-    def getAnalysedTags(self):
-        return self.analysedTags
+    def getAliases(self):
+        return self.aliases
+
+    def getWarnings(self):
+        return self.warnings
 
-    def analyse(self):
+    def classify(self, tagIds):
 
-        # start off with an empty list of analysed microtags
-        self.analysedTags = []
+        # returns the columns (tagTypes, aliasIndices) for a column of tag ids
 
-        # a list of indices referring to unmatched start tags
-        unmatchedStarts = []
+        if haveNumpy(len(tagIds)):
+            if self.numpyTables is None:
+                self.numpyTables = (
+                        numpy.frombuffer(self.tagTypes, dtype=numpy.uint8),
+                        numpy.frombuffer(self.aliasIndices, dtype=numpy.int32))
+            ids = numpy.frombuffer(tagIds, dtype=numpy.uint16)
+            return array('B', self.numpyTables[0][ids].tobytes()), \
+                    array('i', self.numpyTables[1][ids].tobytes())
 
-        # iterate over all raw microtags
-        for i, tag in enumerate(self.getRawTags()):
+        tagTypes = self.tagTypes
+        aliasIndices = self.aliasIndices
+        return array('B', [tagTypes[tagId] for tagId in tagIds]), \
+                array('i', [aliasIndices[tagId] for tagId in tagIds])
 
-            if tag.getTagId() in self.tagDefDict:
+    @staticmethod
+    def findMatchable(tagTypes):
+        # positions of the tags that need more than their classification
+        # (start, stop and vardata tags)
+        if haveNumpy(len(tagTypes)):
+            types = numpy.frombuffer(tagTypes, dtype=numpy.uint8)
+            return numpy.flatnonzero((types == MicrotagType.START) |
+                    (types == MicrotagType.STOP) |
+                    (types == MicrotagType.VARDATA)).tolist()
+        return [k for k, tagType in enumerate(tagTypes)
+                if tagType == MicrotagType.START or tagType == MicrotagType.STOP
+                        or tagType == MicrotagType.VARDATA]
 
-                # microtag id alias from dictionary
-                idAlias = self.tagDefDict[tag.tagId]
 
-                # extract microtag type (start, stop, event, data)
-                if idAlias.startswith('start:'):
-                    analysedTag = MicrotagStart(tag, idAlias[6:])
-                elif idAlias.startswith('stop:'):
-                    analysedTag = MicrotagStop(tag, idAlias[5:])
-                elif idAlias.startswith('event:'):
-                    analysedTag = MicrotagEvent(tag, idAlias[6:])
-                elif idAlias.startswith('data:'):
-                    analysedTag = MicrotagData(tag, idAlias[5:])
-                elif idAlias.startswith('vardata:'):
-                    analysedTag = MicrotagVarData(tag, idAlias[8:])
-                else:
-                    analysedTag = MicrotagUntyped(tag, idAlias)
+#
+# _____________________________________________________________________________
+#
+class MicrotagSequence(object):
 
-            else:
-                analysedTag = MicrotagUntyped(tag)
+    # A read-only sequence of microtags that are created on access from the
+    # columns of a MicrotagList (no microtag objects are kept in memory)
+
+    __slots__ = ('column', 'makeTag')
+
+    def __init__(self, column, makeTag):
+        self.column = column
+        self.makeTag = makeTag
 
-          
-            if isinstance(analysedTag, MicrotagStart):
+    def __len__(self):
+        return len(self.column)
+
+    def __iter__(self):
+        for i in range(len(self.column)):
+            yield self.makeTag(i)
 
-                # add indices of start tags to list of unmatched start tags
-                unmatchedStarts += [i]
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.makeTag(i) for i in range(*index.indices(len(self.column)))]
+        if index < 0:
+            index += len(self.column)
+        if index < 0 or index >= len(self.column):
+            raise IndexError('microtag index out of range')
+        return self.makeTag(index)
 
-            elif isinstance(analysedTag, MicrotagStop):
 
-                # find corresponding start tag
-                matchingStarts = [j for j in unmatchedStarts[::-1] \
-                        if isinstance(self.getAnalysedTags()[j], MicrotagStart) \
-                        and self.getAnalysedTags()[j].getIdAlias() == analysedTag.getIdAlias()]
-                if len(matchingStarts) > 0:
+#
+# _____________________________________________________________________________
+#
+class MicrotagChunk(object):
 
-                    del unmatchedStarts[unmatchedStarts.index(matchingStarts[0])]
+    # The analysed columns of a consecutive block of microtags as produced by
+    # MicrotagAnalyser.analyseBlock(...). Indices in partnerIndices and spans
+    # are global, i.e. they count from the first tag fed to the analyser.
 
-                    analysedTag.setStartTagIndex(matchingStarts[0])
-                    self.getAnalysedTags()[matchingStarts[0]].setStopTagIndex(i)
+    __slots__ = ('firstIndex', 'tagData', 'tagIds', 'tagTypes', 'aliasIndices',
+            'partnerIndices', 'spans', 'varDataPayloads')
 
-            elif isinstance(analysedTag, MicrotagVarData):
-    
-                previousTag = None
-                if len(self.getAnalysedTags()) > 0:
-                    previousTag = self.getAnalysedTags()[-1]
-                if isinstance(previousTag, MicrotagVarData) and \
-                        previousTag.getIdAlias() == analysedTag.getIdAlias() and \
-                        not previousTag.getIsLast():
-                    analysedTag.setPrevious(previousTag)
+    def __init__(self, firstIndex, tagData, tagIds):
+        self.firstIndex = firstIndex
+        self.tagData = tagData
+        self.tagIds = tagIds
+        self.tagTypes = array('B')
+        self.aliasIndices = array('i')
+        self.partnerIndices = array('q')
 
-                analysedTag.processVarData()
+        # matched spans as (alias index, start index, stop index, start data, stop data)
+        self.spans = []
 
-            self.analysedTags += [analysedTag]
+        # first fragment index -> payload of vardata chains touched by this block
+        self.varDataPayloads = {}
 
     def __len__(self):
-        return len(self.rawTags)
+        return len(self.tagData)
 
-    def __str__(self):
+    def getSpans(self):
+        return self.spans
 
-        # prepare output as a list of lines
-        lines = []
 
-        # determine length of longest string in tag id alias dictionary
-        # (removing leading type definitions, if present)
-        widthId = max([len(s if s.find(':') == -1 else s[s.find(':')+1:]) \
-                for s in list(self.tagDefDict.values())] + [8]) + 4
+#
+# _____________________________________________________________________________
+#
+class MicrotagAnalyser(object):
 
-        # determine length of highest tag index
-        widthIndex = len('{0}'.format(len(self.getAnalysedTags())))
-
-        for i, tag in enumerate(self.getAnalysedTags()):
-
-            # ===== tag index =====
-
-            line = '{0:{1}}: '.format(i, widthIndex)
-
-            # ===== tag id or id alias =====
-
-            if isinstance(tag, MicrotagStart):
-                tagType = '<'
-                idAlias = TextFormatter.makeBoldGreen('{0:{1}}' \
-                        .format(tag.getIdAlias(), widthId + 2))
-            elif isinstance(tag, MicrotagStop):
-                tagType = '>'
-                idAlias = TextFormatter.makeBoldRed('{0:{1}}' \
-                        .format(tag.getIdAlias(), widthId + 2))
-            elif isinstance(tag, MicrotagEvent):
-                tagType = '!'
-                idAlias = TextFormatter.makeBoldYellow('{0:{1}}' \
-                        .format(tag.getIdAlias(), widthId + 2))
-            elif isinstance(tag, MicrotagVarData):
-                tagType = 'V'
-                idAlias = TextFormatter.makeBoldBlue('{0:{1}}' \
-                        .format('{0}<{1}>'.format(tag.getIdAlias(), tag.getIndex()), widthId + 2))
-            elif isinstance(tag, MicrotagData):
-                tagType = 'D'
-                idAlias = TextFormatter.makeBoldBlue('{0:{1}}' \
-                        .format(tag.getIdAlias(), widthId + 2))
-            else:
-                tagType = '?'                    
-                if tag.getIdAlias() is not None:
-                    idAlias = tag.getIdAlias()
-                else:
-                    idAlias = '[0x{0:04X}]'.format(tag.getTagId())
-                idAlias = '{0:{1}}'.format(idAlias, widthId + 2)
-
-            line += tagType + ' ' + idAlias
-        
-            # ===== tag content, i.e. time or data =====  
-
-            if isinstance(tag, MicrotagTickBased):
-                line += '{0:>25}  '.format(self.dataToTimeStr(tag.tagData))
-            elif isinstance(tag, MicrotagVarData):
-                if tag.getIsLast():
-                    hexVal = ''.join(['{0:02X}'.format(b) for b in tag.getData()])
-                    line += TextFormatter.makeBoldBlue('[ 0x{0} ]'.format(hexVal))
-                else:
-                    line += TextFormatter.makeBoldBlue('...')
-            else:
-                line += TextFormatter.makeBoldBlue('[ 0x{0:08X} ]  '.format(tag.tagData))
-        
-            # ===== start/stop tag matching =====  
-        
-            if isinstance(tag, MicrotagStart):
+    # Analyses microtags block by block, keeping the state needed to continue
+    # with the next block (open start tags and the pending vardata chain)
 
-                # matching string
-                line += '--->[ {0:{1}} ]' \
-                        .format(str(tag.getStopTagIndex()), widthIndex)
+    def __init__(self, tagDefDict, dispatchTable=None):
+        self.tagDefDict = tagDefDict
 
-            elif isinstance(tag, MicrotagStop):
+        # tag id -> (type code, alias index)
+        if dispatchTable is None:
+            dispatchTable = MicrotagDispatchTable(tagDefDict)
+        self.dispatchTable = dispatchTable
+        self.aliases = dispatchTable.getAliases()
 
-                # matching string
-                line += '[ {0:{1}} ]---({2:^{3}})--->[ {4:{1}} ]' \
-                        .format(str(tag.getStartTagIndex()), widthIndex, tag.getIdAlias(), widthId, i)
-                # time difference
-                line += '{0:>20}'.format(self.dataToTimeDiffStr(
-                        self.getAnalysedTags()[tag.getStartTagIndex()].getTagData(), tag.getTagData()))
+        # global index of the next tag to analyse
+        self.nTags = 0
 
-            lines += [line]
+        # type code and alias index of the last tag analysed
+        self.lastType = MicrotagType.UNTYPED
+        self.lastAliasIndex = -1
 
-        return '\n'.join(lines)
+        # alias index -> stack of (index, data) of unmatched start tags
+        self.openStarts = {}
 
-    def __iter__(self):
-        return iter(self.rawTags)
+        # indices of stop tags without start tag
+        self.orphanStops = array('q')
 
-    def __getitem__(self, index):
-        if isinstance(index, int):
-            return self.rawTags[index]
+        # the vardata chain currently being reassembled (first fragment
+        # index, declared length and payload collected so far)
+        self.chainHead = -1
+        self.chainLength = 0
+        self.chainPayload = None
 
-    def importTagsFromCodes(self, codes):
-        lenBefore = len(self.rawTags)
-        for code in codes.split('\n'):
-            try:
-                tag = Microtag()
-                tag.importFromCode(code)
-                self.rawTags += [tag]
-            except Exception as e:
-                print(e)
-                pass
-        # return the number of tags imported
-        return len(self.rawTags) - lenBefore
+    def getAliases(self):
+        return self.aliases
 
-    def importTagsFromFile(self, filename):
-        f = open(filename, 'r')
-        lines = [line.strip() for line in f]
-        codes = '\n'.join([line for line in lines
-                if len(line) == 8 and line[0] != '#'])
-        f.close()
-        if len(codes) > 0:
-            return self.importTagsFromCodes(codes)
-        else:
-            return 0
+    def getOrphanStops(self):
+        return self.orphanStops
 
-    def importTagDefsFromFile(self, filename):
-        f = open(filename, 'r')
-        lines = [line.strip() for line in f]
-        tagDefs = [line for line in lines
-                if len(line) > 0 and line[0] != '#']
-        f.close()
+    def getUnmatchedStarts(self):
+        # start tags left on the stacks have not seen their stop tag (yet)
+        return array('q', sorted(
+                [j for stack in self.openStarts.values() for j, data in stack]))
 
-        nBefore = len(self.tagDefDict)
+    def analyseBlock(self, tagData, tagIds):
 
-        for tagDef in tagDefs:
-            tokens = [token.strip() for token in tagDef.split(',')]
-            if len(tokens) != 2:
-                # >>> invalid line >>>
-                continue
-            if not tokens[0].startswith('0x'):
-                # >>> invalid line >>>
-                continue
+        chunk = MicrotagChunk(self.nTags, tagData, tagIds)
 
-            self.tagDefDict[int(tokens[0][2:], base = 16)] = tokens[1]
+        # classify all microtags of the block at once
+        tagTypes, aliasIndices = self.dispatchTable.classify(tagIds)
+        partnerIndices = array('q', [-1]) * len(tagTypes)
+        chunk.tagTypes = tagTypes
+        chunk.aliasIndices = aliasIndices
+        chunk.partnerIndices = partnerIndices
 
-        return len(self.tagDefDict) - nBefore
+        spans = chunk.spans
+        payloads = chunk.varDataPayloads
+        firstIndex = chunk.firstIndex
 
-    def printList(self):
-        pass
+        openStarts = self.openStarts
+        chainHead = self.chainHead
+        chainLength = self.chainLength
+        chainPayload = self.chainPayload
+
+        # iterate over the start, stop and vardata tags of the block (the
+        # others are done with their classification)
+        for k in MicrotagDispatchTable.findMatchable(tagTypes):
+
+            i = firstIndex + k
+            tagType = tagTypes[k]
+            aliasIndex = aliasIndices[k]
+            data = tagData[k]
+
+            if tagType == MicrotagType.START:
+
+                # push start tag onto the stack of its alias
+                if aliasIndex in openStarts:
+                    openStarts[aliasIndex].append((i, data))
+                else:
+                    openStarts[aliasIndex] = [(i, data)]
+
+            elif tagType == MicrotagType.STOP:
+
+                # the corresponding start tag is the latest unmatched one
+                # with the same alias
+                stack = openStarts.get(aliasIndex)
+                if stack:
+                    partner, startData = stack.pop()
+                    if partner >= firstIndex:
+                        partnerIndices[partner - firstIndex] = i
+                    partnerIndices[k] = partner
+                    spans.append((aliasIndex, partner, i, startData, data))
+                else:
+                    self.orphanStops.append(i)
+
+            else:
+
+                # type and alias of the microtag right before this one
+                if k > 0:
+                    prevType = tagTypes[k - 1]
+                    prevAliasIndex = aliasIndices[k - 1]
+                else:
+                    prevType = self.lastType
+                    prevAliasIndex = self.lastAliasIndex
+
+                if chainHead >= 0 and prevType == MicrotagType.VARDATA and \
+                        prevAliasIndex == aliasIndex and \
+                        len(chainPayload) < chainLength:
+                    # >>> next fragment of the current vardata chain >>>
+                    chainPayload += data.to_bytes(4, byteorder='big') \
+                            [:chainLength - len(chainPayload)]
+                else:
+                    # >>> first fragment of a new vardata chain >>>
+                    chainHead = i
+                    chainLength = data >> 24
+                    chainPayload = bytearray((data & 0x00FFFFFF) \
+                            .to_bytes(3, byteorder='big')[:chainLength])
+
+                payloads[chainHead] = chainPayload
+                partnerIndices[k] = chainHead
+
+        # hand out immutable snapshots of the payloads touched by this block
+        for head in payloads:
+            payloads[head] = bytes(payloads[head])
+
+        self.nTags += len(tagTypes)
+        if len(tagTypes) > 0:
+            self.lastType = tagTypes[-1]
+            self.lastAliasIndex = aliasIndices[-1]
+        self.chainHead = chainHead
+        self.chainLength = chainLength
+        self.chainPayload = chainPayload
+
+        return chunk
 
 
 #
 # _____________________________________________________________________________
 #
-def main(argv):
+class MicrotagTimeline(object):
 
-    if len(argv) == 2:
-        tagDefFilename = argv[0]
-        tagsFilename = argv[1]
-    else:
-        print("Wrong number of arguments. Stopping.")
-        print("Expecting <tag-def-file> <tag-file>")
-        return
+    # Unwraps the 32-bit tick counter of tick-based microtags (start, stop,
+    # event) into a monotonic 64-bit timeline and converts ticks to seconds.
+    # The counter is assumed to wrap at most once between two consecutive
+    # tick-based microtags. Microtags without ticks inherit the time of the
+    # preceding tick-based microtag (-1 before the first one).
 
-    # read input file
-    microtags = MicrotagList() #, lambda c: (c / 84E6, 's', 3))
+    tickBits = 32
 
-    try:
-        n = microtags.importTagDefsFromFile(tagDefFilename)
-        print(('Imported {0} microtag definition(s).'.format(n)))
-    except Exception as e:
-        print("Failed to read/parse input file. Stopping.")
-        print(e)
-        return
+    def __init__(self, clockFrequency=None):
+        # clock frequency in Hz (None to present times in ticks)
+        self.clockFrequency = clockFrequency
+        self.reset()
 
-    try:
-        n = microtags.importTagsFromFile(tagsFilename)
-        print(('Imported {0} microtag(s).'.format(n)))
-    except Exception as e:
-        print("Failed to read/parse input file. Stopping.")
-        print(e)
-        return
+    def reset(self):
+        # last raw tick seen, number of wraps so far and last unwrapped tick
+        self.lastTick = None
+        self.nWraps = 0
+        self.lastTime = -1
 
-    microtags.analyse()
+    def getClockFrequency(self):
+        return self.clockFrequency
 
-    print(microtags)
+    def getNumberOfWraps(self):
+        return self.nWraps
+
+    @staticmethod
+    def tickDifference(startTick, stopTick):
+        # ticks elapsed between two raw ticks at most one wrap apart
+        return (stopTick - startTick) & ((1 << MicrotagTimeline.tickBits) - 1)
+
+    def ticksToTime(self, ticks):
+        # (value, unit, precision) as expected by MicrotagList.dataToTime
+        if self.clockFrequency is None:
+            return ticks, 'ticks', 0
+        return ticks / self.clockFrequency, 's', 6
+
+    def ticksToSeconds(self, ticks):
+        # convert a column of unwrapped ticks in one pass
+        if self.clockFrequency is None:
+            raise ValueError('No clock frequency set')
+        if haveNumpy():
+            return numpy.frombuffer(ticks, dtype=numpy.int64) / self.clockFrequency
+        return [t / self.clockFrequency for t in ticks]
+
+    def unwrapBlock(self, tagData, tagTypes):
+
+        # Returns the unwrapped ticks of a block of analysed microtags as an
+        # array('q') and keeps the state needed to continue with the next block
+
+        if haveNumpy(len(tagData)):
+            return self.unwrapBlockNumpy(tagData, tagTypes)
+
+        times = array('q')
+        lastTick = self.lastTick
+        nWraps = self.nWraps
+        lastTime = self.lastTime
+
+        for data, tagType in zip(tagData, tagTypes):
+            if MicrotagType.START <= tagType <= MicrotagType.EVENT:
+                if lastTick is not None and data < lastTick:
+                    nWraps += 1
+                lastTick = data
+                lastTime = data + (nWraps << self.tickBits)
+            times.append(lastTime)
+
+        self.lastTick = lastTick
+        self.nWraps = nWraps
+        self.lastTime = lastTime
+
+        return times
+
+    def unwrapBlockNumpy(self, tagData, tagTypes):
+
+        data = numpy.frombuffer(tagData, dtype=numpy.uint32)
+        types = numpy.frombuffer(tagTypes, dtype=numpy.uint8)
+        isTick = (types >= MicrotagType.START) & (types <= MicrotagType.EVENT)
+
+        ticks = data[isTick].astype(numpy.int64)
+        if len(ticks) > 0:
+            # a tick smaller than its predecessor marks a wrap of the counter
+            previous = ticks[0] if self.lastTick is None else self.lastTick
+            wraps = numpy.cumsum(numpy.diff(ticks, prepend=previous) < 0)
+            unwrapped = ticks + ((wraps + self.nWraps) << self.tickBits)
+            self.nWraps += int(wraps[-1])
+            self.lastTick = int(ticks[-1])
+        else:
+            unwrapped = ticks
+
+        # forward-fill the time of the latest tick-based microtag
+        times = numpy.concatenate((numpy.array([self.lastTime], dtype=numpy.int64),
+                unwrapped))[numpy.cumsum(isTick)]
+
+        if len(unwrapped) > 0:
+            self.lastTime = int(unwrapped[-1])
+
+        return array('q', times.tobytes())
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagIndex(object):
+
+    # Precomputed indexes over the analysed columns of a MicrotagList: the
+    # positions of every alias and type, and per alias the matched spans
+    # sorted by start time and by duration. Times are unwrapped ticks, which
+    # are monotonic in the tag index, so positions sorted by index are also
+    # sorted by time and can be searched by bisection.
+
+    def __init__(self, microtagList):
+
+        self.ticks = microtagList.getTicks()
+        self.aliases = list(microtagList.aliases)
+        self.aliasIndexDict = dict([(idAlias, i)
+                for i, idAlias in enumerate(self.aliases)])
+        self.nTags = len(microtagList.tagTypes)
+
+        # key -> (positions, ticks at these positions) where the key is the
+        # alias index, the type code or both combined (see findTags())
+        self.aliasPositions = self.groupPositions(microtagList.aliasIndices)
+        self.typePositions = self.groupPositions(microtagList.tagTypes)
+        self.aliasTypePositions = self.groupPositions(array('q', [
+                (aliasIndex << 8) | tagType for aliasIndex, tagType in
+                zip(microtagList.aliasIndices, microtagList.tagTypes)]))
+
+        # alias index (None for all aliases) -> spans of that alias
+        self.spans = self.buildSpans(microtagList)
+
+    def groupPositions(self, column):
+
+        # split the positions 0..n-1 by the value of column at that position
+        groups = {}
+        if len(column) > 0 and haveNumpy(len(column)):
+            values = numpy.frombuffer(column, dtype=column.typecode)
+            order = numpy.argsort(values, kind='stable')
+            keys, firsts = numpy.unique(values[order], return_index=True)
+            ticks = numpy.frombuffer(self.ticks, dtype=numpy.int64)
+            for key, positions in zip(keys.tolist(),
+                    numpy.split(order.astype(numpy.int64), firsts[1:])):
+                groups[key] = (array('q', positions.tobytes()),
+                        array('q', ticks[positions].tobytes()))
+        else:
+            for i, key in enumerate(column):
+                if key not in groups:
+                    groups[key] = (array('q'), array('q'))
+                groups[key][0].append(i)
+                groups[key][1].append(self.ticks[i])
+        return groups
+
+    def buildSpans(self, microtagList):
+
+        # matched spans in the order of their start tags (i.e. by start time)
+        spans = {}
+        positions = self.typePositions.get(MicrotagType.START, (array('q'),))[0]
+        for start in positions:
+            stop = microtagList.partnerIndices[start]
+            if stop < 0:
+                continue
+            for key in (None, microtagList.aliasIndices[start]):
+                if key not in spans:
+                    spans[key] = MicrotagSpanIndex()
+                spans[key].append(start, self.ticks[start], self.ticks[stop])
+
+        for spanIndex in spans.values():
+            spanIndex.sortByDuration()
+        return spans
+
+    def getAliasIndex(self, idAlias):
+        if idAlias not in self.aliasIndexDict:
+            raise KeyError('Unknown alias "{0}"'.format(idAlias))
+        return self.aliasIndexDict[idAlias]
+
+    def window(self, times, begin, end):
+        # slice of a sorted time column falling into [begin, end]
+        lo = 0 if begin is None else bisect.bisect_left(times, begin)
+        hi = len(times) if end is None else bisect.bisect_right(times, end)
+        return lo, max(lo, hi)
+
+    def findTags(self, idAlias=None, tagType=None, begin=None, end=None):
+
+        # positions of the microtags with the given alias and/or type within
+        # the time window [begin, end] (as a view whenever possible)
+
+        if idAlias is None and tagType is None:
+            lo, hi = self.window(self.ticks, begin, end)
+            return memoryview(array('q', range(lo, hi)))
+
+        if tagType is None:
+            group = self.aliasPositions, self.getAliasIndex(idAlias)
+        elif idAlias is None:
+            group = self.typePositions, tagType
+        else:
+            group = self.aliasTypePositions, \
+                    (self.getAliasIndex(idAlias) << 8) | tagType
+        positions, times = group[0].get(group[1], (array('q'), array('q')))
+
+        lo, hi = self.window(times, begin, end)
+        return memoryview(positions)[lo:hi]
+
+    def findSpans(self, idAlias=None, begin=None, end=None, minDuration=None,
+            maxDuration=None, overlapping=False):
+
+        # Start tag indices of the matched spans with the given alias whose
+        # duration lies in [minDuration, maxDuration] and that lie within the
+        # time window [begin, end] (or only overlap it if overlapping is set)
+
+        key = None if idAlias is None else self.getAliasIndex(idAlias)
+        if key not in self.spans:
+            return memoryview(array('q'))
+        return self.spans[key].find(begin, end, minDuration, maxDuration,
+                overlapping)
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagSpanIndex(object):
+
+    # Interval index over matched spans: columns sorted by start time plus the
+    # longest duration, which bounds how far back an overlapping span may
+    # start, and a second order sorted by duration
+
+    def __init__(self):
+        self.starts = array('q')
+        self.begins = array('q')
+        self.ends = array('q')
+        self.maxDuration = 0
+        self.durations = array('q')
+        self.startsByDuration = array('q')
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, start, begin, end):
+        self.starts.append(start)
+        self.begins.append(begin)
+        self.ends.append(end)
+        self.maxDuration = max(self.maxDuration, end - begin)
+
+    def sortByDuration(self):
+        order = sorted(range(len(self.starts)),
+                key=lambda j: self.ends[j] - self.begins[j])
+        self.durations = array('q', [self.ends[j] - self.begins[j] for j in order])
+        self.startsByDuration = array('q', [self.starts[j] for j in order])
+
+    def find(self, begin, end, minDuration, maxDuration, overlapping):
+
+        if begin is None and end is None:
+            # >>> duration query only: a slice of the duration order >>>
+            lo = 0 if minDuration is None else \
+                    bisect.bisect_left(self.durations, minDuration)
+            hi = len(self.durations) if maxDuration is None else \
+                    bisect.bisect_right(self.durations, maxDuration)
+            if minDuration is None and maxDuration is None:
+                return memoryview(self.starts)
+            return memoryview(array('q', sorted(self.startsByDuration[lo:max(lo, hi)])))
+
+        # candidates have to start within the window (or, if overlapping,
+        # no earlier than the longest span before it)
+        if begin is None:
+            lo = 0
+        elif overlapping:
+            lo = bisect.bisect_left(self.begins, begin - self.maxDuration)
+        else:
+            lo = bisect.bisect_left(self.begins, begin)
+        hi = len(self.begins) if end is None else \
+                bisect.bisect_right(self.begins, end)
+
+        result = array('q')
+        for j in range(lo, max(lo, hi)):
+            duration = self.ends[j] - self.begins[j]
+            if minDuration is not None and duration < minDuration:
+                continue
+            if maxDuration is not None and duration > maxDuration:
+                continue
+            if begin is not None and overlapping and self.ends[j] < begin:
+                continue
+            if end is not None and not overlapping and self.ends[j] > end:
+                continue
+            result.append(self.starts[j])
+        return memoryview(result)
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagQuantileSketch(object):
+
+    # Quantile sketch with bounded relative error: values are counted in
+    # buckets growing geometrically by gamma, so the memory needed is bounded
+    # by the range of values (about 2,200 buckets for 64-bit ticks at 1%
+    # accuracy) and not by how many values are added. Sketches of the same
+    # accuracy can be merged.
+
+    __slots__ = ('accuracy', 'logGamma', 'buckets', 'nZero', 'count')
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.logGamma = math.log((1. + accuracy) / (1. - accuracy))
+        self.buckets = {}
+        self.nZero = 0
+        self.count = 0
+
+    def add(self, value):
+        if value <= 0:
+            self.nZero += 1
+        else:
+            key = math.ceil(math.log(value) / self.logGamma)
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+        self.count += 1
+
+    def addArray(self, values):
+        # add an array of values at once (value by value without numpy)
+        if not haveNumpy():
+            for value in values:
+                self.add(value)
+            return
+        values = numpy.asarray(values)
+        positive = values[values > 0]
+        keys, counts = numpy.unique(numpy.ceil(
+                numpy.log(positive) / self.logGamma), return_counts=True)
+        for key, n in zip(keys.astype(numpy.int64).tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        self.nZero += len(values) - len(positive)
+        self.count += len(values)
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError('Cannot merge sketches of different accuracy')
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        self.nZero += other.nZero
+        self.count += other.count
+
+    def getCount(self):
+        return self.count
+
+    def getQuantile(self, q):
+        # estimate of the value of rank q*(count - 1) (None if empty)
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.nZero
+        if rank < seen:
+            return 0.
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # the value in the middle of the bucket (in relative terms)
+                return 2. * math.exp(key * self.logGamma) / \
+                        (1. + math.exp(self.logGamma))
+        return math.exp(max(self.buckets) * self.logGamma)
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagStats(object):
+
+    # Streaming statistics of a series of values: count, minimum, maximum,
+    # mean and variance (using Welford's algorithm, which unlike sums of
+    # squares stays accurate for large tick counts) plus quantiles from a
+    # MicrotagQuantileSketch
+
+    __slots__ = ('count', 'mean', 'm2', 'minimum', 'maximum', 'sketch')
+
+    quantiles = (0.5, 0.95, 0.99)
+
+    def __init__(self, accuracy=0.01):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.minimum = None
+        self.maximum = None
+        self.sketch = MicrotagQuantileSketch(accuracy)
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        self.sketch.add(value)
+
+    def addArray(self, values):
+        # add an array of values at once (two-pass within the array, then
+        # combined as in merge(), value by value without numpy)
+        if len(values) == 0:
+            return
+        if not haveNumpy():
+            for value in values:
+                self.add(value)
+            return
+        values = numpy.asarray(values)
+        other = MicrotagStats(self.sketch.accuracy)
+        other.count = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean)**2).sum())
+        other.minimum = values.min().item()
+        other.maximum = values.max().item()
+        other.sketch.addArray(values)
+        self.merge(other)
+
+    def merge(self, other):
+        # combine with the statistics of another series (Chan et al.)
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.minimum, self.maximum = other.minimum, other.maximum
+        else:
+            self.minimum = min(self.minimum, other.minimum)
+            self.maximum = max(self.maximum, other.maximum)
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.sketch.merge(other.sketch)
+
+    def getCount(self):
+        return self.count
+
+    def getMean(self):
+        return self.mean
+
+    def getMinimum(self):
+        return self.minimum
+
+    def getMaximum(self):
+        return self.maximum
+
+    def getVariance(self):
+        # sample variance (0 for less than two values)
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.
+
+    def getStdDev(self):
+        return math.sqrt(self.getVariance())
+
+    def getQuantile(self, q):
+        # the sketch's estimate clamped to the exact range of values
+        value = self.sketch.getQuantile(q)
+        if value is None:
+            return None
+        return min(max(value, self.minimum), self.maximum)
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagSpanStats(object):
+
+    # Aggregates span durations per alias in a single streaming pass. With
+    # groupBy, durations are additionally grouped by the current values of
+    # the listed data tags (the value of the latest such tag before the stop
+    # tag, None if there was none yet).
+
+    def __init__(self, aliases, groupBy=None, accuracy=0.01):
+        self.aliases = aliases
+        self.groupBy = list(groupBy or [])
+        self.accuracy = accuracy
+
+        # alias index of a data tag -> position in the state tuple
+        self.stateIndices = {}
+        for j, idAlias in enumerate(self.groupBy):
+            if idAlias not in aliases:
+                raise KeyError('Unknown alias "{0}"'.format(idAlias))
+            self.stateIndices[aliases.index(idAlias)] = j
+        self.state = [None] * len(self.groupBy)
+
+        # (alias index, state tuple) -> MicrotagStats
+        self.groups = {}
+
+    def add(self, aliasIndex, duration):
+        key = (aliasIndex, tuple(self.state))
+        if key not in self.groups:
+            self.groups[key] = MicrotagStats(self.accuracy)
+        self.groups[key].add(duration)
+
+    def addChunk(self, chunk):
+
+        # add the spans of an analysed MicrotagChunk (spans come in the order
+        # of their stop tags, interleaved here with the state updates)
+
+        if len(self.stateIndices) == 0:
+            for aliasIndex, start, stop, startData, stopData in chunk.getSpans():
+                self.add(aliasIndex, MicrotagTimeline.tickDifference(startData, stopData))
+            return
+
+        spans = chunk.getSpans()
+        j = 0
+        for i, tagType in enumerate(chunk.tagTypes, chunk.firstIndex):
+            while j < len(spans) and spans[j][2] < i:
+                aliasIndex, start, stop, startData, stopData = spans[j]
+                self.add(aliasIndex, MicrotagTimeline.tickDifference(startData, stopData))
+                j += 1
+            if tagType == MicrotagType.DATA:
+                aliasIndex = chunk.aliasIndices[i - chunk.firstIndex]
+                if aliasIndex in self.stateIndices:
+                    self.state[self.stateIndices[aliasIndex]] = \
+                            chunk.tagData[i - chunk.firstIndex]
+        for aliasIndex, start, stop, startData, stopData in spans[j:]:
+            self.add(aliasIndex, MicrotagTimeline.tickDifference(startData, stopData))
+
+    def addList(self, microtagList):
+
+        # add the matched spans of an analysed MicrotagList (using the
+        # unwrapped timeline for the durations)
+
+        ticks = microtagList.getTicks()
+        aliasIndices = microtagList.aliasIndices
+        partnerIndices = microtagList.partnerIndices
+        tagData = microtagList.tagData
+        for i, tagType in enumerate(microtagList.tagTypes):
+            if tagType == MicrotagType.STOP:
+                if partnerIndices[i] >= 0:
+                    self.add(aliasIndices[i], ticks[i] - ticks[partnerIndices[i]])
+            elif tagType == MicrotagType.DATA and aliasIndices[i] in self.stateIndices:
+                self.state[self.stateIndices[aliasIndices[i]]] = tagData[i]
+
+    def merge(self, other):
+        for key, stats in other.groups.items():
+            if key not in self.groups:
+                self.groups[key] = MicrotagStats(self.accuracy)
+            self.groups[key].merge(stats)
+
+    def getGroupBy(self):
+        return self.groupBy
+
+    def getGroups(self):
+        # (alias, state tuple) -> MicrotagStats, sorted by alias and state
+        return dict(sorted([((self.aliases[aliasIndex], state), stats)
+                for (aliasIndex, state), stats in self.groups.items()],
+                key=lambda item: (item[0][0], [(v is not None, v or 0)
+                        for v in item[0][1]])))
+
+    def groupToStr(self, idAlias, state):
+        # alias followed by the grouping values, e.g. "Loop{Size=0x00000010}"
+        if len(self.groupBy) == 0:
+            return idAlias
+        return '{0}{{{1}}}'.format(idAlias, ','.join(['{0}={1}'.format(name,
+                '-' if value is None else '0x{0:08X}'.format(value))
+                for name, value in zip(self.groupBy, state)]))
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagSpanTree(object):
+
+    # Call tree of the matched spans of an analysed MicrotagList, built in a
+    # single pass over start and stop tags with a stack of open spans: a span
+    # is a child of the innermost span still open at its start. Spans with the
+    # same path of aliases from the root share a node, which aggregates their
+    # count, total time and self time (total time minus the total time of
+    # the direct children).
+
+    def __init__(self, aliases):
+        self.aliases = aliases
+
+        # nodes as [parent node, alias index, count, total ticks, self ticks]
+        self.nodes = []
+
+        # (parent node, alias index) -> node (parent -1 for roots)
+        self.nodeIndexDict = {}
+
+    def getNode(self, parent, aliasIndex):
+        key = (parent, aliasIndex)
+        node = self.nodeIndexDict.get(key)
+        if node is None:
+            node = len(self.nodes)
+            self.nodeIndexDict[key] = node
+            self.nodes.append([parent, aliasIndex, 0, 0, 0])
+        return node
+
+    def addList(self, microtagList):
+
+        ticks = microtagList.getTicks()
+        tagTypes = microtagList.tagTypes
+        aliasIndices = microtagList.aliasIndices
+        partnerIndices = microtagList.partnerIndices
+        nodes = self.nodes
+
+        # positions of start and stop tags (in the order of the trace)
+        if haveNumpy(len(tagTypes)):
+            types = numpy.frombuffer(tagTypes, dtype=numpy.uint8)
+            positions = numpy.flatnonzero((types == MicrotagType.START) |
+                    (types == MicrotagType.STOP)).tolist()
+        else:
+            positions = [i for i, tagType in enumerate(tagTypes)
+                    if tagType == MicrotagType.START or tagType == MicrotagType.STOP]
+
+        # open spans as [node, start index, total ticks of children, parent]
+        stack = []
+        for i in positions:
+            partner = partnerIndices[i]
+            if partner < 0:
+                # unmatched start or orphan stop tags are not part of the tree
+                continue
+            if tagTypes[i] == MicrotagType.START:
+                parent = stack[-1] if stack else None
+                stack.append([self.getNode(parent[0] if parent else -1,
+                        aliasIndices[i]), i, 0, parent])
+                continue
+
+            # the span is on top of the stack unless it crosses another span
+            # (e.g. start:A start:B stop:A stop:B), the crossing span then
+            # stays open with its original path
+            j = len(stack) - 1
+            while stack[j][1] != partner:
+                j -= 1
+            frame = stack.pop(j)
+            node, start, childTicks, parent = frame
+            total = ticks[i] - ticks[start]
+            entry = nodes[node]
+            entry[2] += 1
+            entry[3] += total
+            entry[4] += total - childTicks
+
+            # a crossing span outliving its parent does not count as a child
+            if parent is not None and parent[1] >= 0:
+                parent[2] += total
+            frame[1] = -1
+
+    def getPath(self, node):
+        # aliases from the root down to a node
+        path = []
+        while node >= 0:
+            path.append(self.aliases[self.nodes[node][1]])
+            node = self.nodes[node][0]
+        return path[::-1]
+
+    def iterNodes(self):
+        # (depth, node) in depth-first order, siblings sorted by alias
+        children = {}
+        for node, entry in enumerate(self.nodes):
+            children.setdefault(entry[0], []).append(node)
+        pending = [(0, node) for node in sorted(children.get(-1, []),
+                key=lambda node: self.aliases[self.nodes[node][1]], reverse=True)]
+        while pending:
+            depth, node = pending.pop()
+            yield depth, node
+            pending += [(depth + 1, child) for child in sorted(children.get(node, []),
+                    key=lambda child: self.aliases[self.nodes[child][1]], reverse=True)]
+
+    def getPaths(self):
+        # path string ("A;B;C") -> (count, total ticks, self ticks)
+        return dict([(';'.join(self.getPath(node)), tuple(self.nodes[node][2:]))
+                for depth, node in self.iterNodes()])
+
+    def writeFolded(self, f, batchSize=4096):
+
+        # Writes the self time of every path in folded-stack format (one
+        # "A;B;C ticks" line per path) as read by flame graph tools. Paths
+        # are built incrementally along the depth-first walk.
+
+        names = []
+        lines = []
+        for depth, node in self.iterNodes():
+            parent, aliasIndex, count, total, selfTicks = self.nodes[node]
+            del names[depth:]
+            names.append(self.aliases[aliasIndex])
+            lines.append('{0} {1}\n'.format(';'.join(names), selfTicks))
+            if len(lines) >= batchSize:
+                f.write(''.join(lines))
+                lines = []
+        f.write(''.join(lines))
+
+    def treeToLines(self, dataToTime=None):
+
+        # indented tree with count, total time and self time per path
+
+        if dataToTime is None:
+            dataToTime = lambda c: (c, 'ticks', 0)
+        timeStr = lambda t: '{0:,.{1}f}'.format(t[0], t[2])
+
+        header = ['span', 'count', 'total', 'self']
+        rows = [['  ' * depth + self.aliases[self.nodes[node][1]],
+                str(self.nodes[node][2])] +
+                [timeStr(dataToTime(value)) for value in self.nodes[node][3:]]
+                for depth, node in self.iterNodes()]
+
+        widths = [max([len(row[i]) for row in rows + [header]])
+                for i in range(len(header))]
+        return ['  '.join(['{0:{1}}'.format(cell, width) if i == 0 else
+                '{0:>{1}}'.format(cell, width)
+                for i, (cell, width) in enumerate(zip(row, widths))])
+                for row in [header] + rows]
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagGrouping(object):
+
+    # Declarative grouping of span durations by state. The configuration
+    # (usually read from a JSON file) contains
+    #   'state': aliases of data tags whose current values form the state,
+    #   'spans': aliases of the spans to measure (all spans if missing),
+    #   'x':     a state alias to group by within each name (optional),
+    #   'names': rules {'match': {alias: condition}, 'name': format} mapping
+    #            the state to a name, the first matching rule wins and spans
+    #            matching no rule are dropped (default: the span's alias).
+    # A condition is a value, a list of values or a {'min': .., 'max': ..}
+    # range, where values may be given as strings like '0x10'. Names are
+    # format strings over the state aliases and 'alias'.
+
+    def __init__(self, config):
+        self.stateAliases = list(config.get('state', []))
+        self.spanAliases = list(config.get('spans', []))
+        self.x = config.get('x')
+        self.rules = [(self.parseMatch(rule.get('match', {})), rule['name'])
+                for rule in config.get('names', [{'name': '{alias}'}])]
+
+        # state aliases used in names (the state the result is grouped by)
+        self.nameFields = []
+        for conditions, name in self.rules:
+            for literal, field, spec, conversion in string.Formatter().parse(name):
+                if field is not None and field != 'alias' and field not in self.nameFields:
+                    self.nameFields.append(field)
+
+        for idAlias in [self.x] * (self.x is not None) + self.nameFields + \
+                [idAlias for conditions, name in self.rules for idAlias in conditions]:
+            if idAlias not in self.stateAliases:
+                raise ValueError('"{0}" is not a state alias'.format(idAlias))
+
+    @staticmethod
+    def fromFile(filename):
+        with open(filename, 'r') as f:
+            return MicrotagGrouping(json.load(f))
+
+    @staticmethod
+    def parseValue(value):
+        return int(value, 0) if isinstance(value, str) else value
+
+    @staticmethod
+    def parseMatch(match):
+        # alias -> (list of values or None, minimum or None, maximum or None)
+        conditions = {}
+        for idAlias, condition in match.items():
+            if isinstance(condition, dict):
+                conditions[idAlias] = (None,
+                        MicrotagGrouping.parseValue(condition.get('min')),
+                        MicrotagGrouping.parseValue(condition.get('max')))
+            elif isinstance(condition, list):
+                conditions[idAlias] = ([MicrotagGrouping.parseValue(value)
+                        for value in condition], None, None)
+            else:
+                conditions[idAlias] = (
+                        [MicrotagGrouping.parseValue(condition)], None, None)
+        return conditions
+
+    def getStateAliases(self):
+        return self.stateAliases
+
+    def getAliasIndices(self, aliases, names):
+        # index of every alias in aliases, -1 for aliases the tag definitions
+        # do not define (no microtag has them, so they are never seen)
+        return [aliases.index(idAlias) if idAlias in aliases else -1
+                for idAlias in names]
+
+    def makeName(self, rule, idAlias, state):
+        # state maps state aliases to their values (None if not seen yet)
+        return self.rules[rule][1].format(alias=idAlias, **state)
+
+    def matchRule(self, state):
+        # index of the first rule matching the state dictionary (or -1)
+        for rule, (conditions, name) in enumerate(self.rules):
+            for idAlias, (values, minimum, maximum) in conditions.items():
+                value = state[idAlias]
+                if value is None or (values is not None and value not in values) or \
+                        (minimum is not None and value < minimum) or \
+                        (maximum is not None and value > maximum):
+                    break
+            else:
+                return rule
+        return -1
+
+    def apply(self, microtagList):
+
+        # Returns name -> (x value -> MicrotagStats) of the span durations
+        # of an analysed MicrotagList (x value None if no 'x' is configured)
+
+        token = microtagList.profile.begin('group')
+        if haveNumpy():
+            result = self.applyNumpy(microtagList)
+        else:
+            result = self.applyLoop(microtagList)
+        microtagList.profile.end(token, len(microtagList.tagTypes))
+        return result
+
+    def applyNumpy(self, microtagList):
+
+        aliases = microtagList.aliases
+        ticks = numpy.frombuffer(microtagList.getTicks(), dtype=numpy.int64)
+        tagTypes = numpy.frombuffer(microtagList.tagTypes, dtype=numpy.uint8)
+        aliasIndices = numpy.frombuffer(microtagList.aliasIndices, dtype=numpy.int32)
+        partnerIndices = numpy.frombuffer(microtagList.partnerIndices, dtype=numpy.int64)
+        tagData = numpy.frombuffer(microtagList.tagData, dtype=numpy.uint32)
+
+        # matched spans to measure, identified by their stop tags
+        isSpan = (tagTypes == MicrotagType.STOP) & (partnerIndices >= 0)
+        if len(self.spanAliases) > 0:
+            isSpan &= numpy.isin(aliasIndices,
+                    self.getAliasIndices(aliases, self.spanAliases))
+        stops = numpy.flatnonzero(isSpan)
+        durations = ticks[stops] - ticks[partnerIndices[stops]]
+
+        # forward-fill the value of every state alias to the stop tags
+        # (-1 where no such data tag was seen yet or the alias is undefined)
+        state = {}
+        for idAlias, aliasIndex in zip(self.stateAliases,
+                self.getAliasIndices(aliases, self.stateAliases)):
+            positions = numpy.flatnonzero(
+                    (tagTypes == MicrotagType.DATA) & (aliasIndices == aliasIndex))
+            latest = numpy.searchsorted(positions, stops, side='right') - 1
+            values = numpy.concatenate((numpy.array([-1], dtype=numpy.int64),
+                    tagData[positions].astype(numpy.int64)))
+            state[idAlias] = values[latest + 1]
+
+        # first matching rule per span
+        rules = numpy.full(len(stops), -1, dtype=numpy.int64)
+        for rule, (conditions, name) in enumerate(self.rules):
+            match = rules < 0
+            for idAlias, (values, minimum, maximum) in conditions.items():
+                match &= state[idAlias] >= 0
+                if values is not None:
+                    match &= numpy.isin(state[idAlias], values)
+                if minimum is not None:
+                    match &= state[idAlias] >= minimum
+                if maximum is not None:
+                    match &= state[idAlias] <= maximum
+            rules[match] = rule
+
+        # group by rule, alias, state used in names and x
+        keep = rules >= 0
+        xColumn = [state[self.x][keep]] if self.x is not None else []
+        keys = numpy.stack([rules[keep], aliasIndices[stops][keep].astype(numpy.int64)] +
+                [state[field][keep] for field in self.nameFields] + xColumn, axis=1)
+        durations = durations[keep]
+        if len(durations) == 0:
+            return {}
+        groups, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = numpy.argsort(inverse, kind='stable')
+        bounds = numpy.cumsum(numpy.bincount(inverse, minlength=len(groups)))[:-1]
+
+        result = {}
+        for group, values in zip(groups.tolist(), numpy.split(durations[order], bounds)):
+            groupState = dict([(field, None if value < 0 else value)
+                    for field, value in zip(self.nameFields, group[2:])])
+            name = self.makeName(group[0], aliases[group[1]], groupState)
+            x = (None if group[-1] < 0 else group[-1]) if self.x is not None else None
+            stats = result.setdefault((group[0], name), {}).setdefault(
+                    x, MicrotagStats())
+            stats.addArray(values)
+
+        return self.sortResult(result)
+
+    def applyLoop(self, microtagList):
+
+        # the same as apply() without numpy, tracking the state tag by tag
+
+        aliases = microtagList.aliases
+        ticks = microtagList.getTicks()
+        spanIndices = set(self.getAliasIndices(aliases, self.spanAliases))
+        stateIndices = dict([(aliasIndex, idAlias) for aliasIndex, idAlias in
+                zip(self.getAliasIndices(aliases, self.stateAliases), self.stateAliases)
+                if aliasIndex >= 0])
+        state = dict([(idAlias, None) for idAlias in self.stateAliases])
+
+        result = {}
+        for i, tagType in enumerate(microtagList.tagTypes):
+            aliasIndex = microtagList.aliasIndices[i]
+            if tagType == MicrotagType.DATA and aliasIndex in stateIndices:
+                state[stateIndices[aliasIndex]] = microtagList.tagData[i]
+            elif tagType == MicrotagType.STOP and microtagList.partnerIndices[i] >= 0 \
+                    and (len(self.spanAliases) == 0 or aliasIndex in spanIndices):
+                rule = self.matchRule(state)
+                if rule < 0:
+                    continue
+                name = self.makeName(rule, aliases[aliasIndex], state)
+                x = state[self.x] if self.x is not None else None
+                stats = result.setdefault((rule, name), {}).setdefault(
+                        x, MicrotagStats())
+                stats.add(ticks[i] - ticks[microtagList.partnerIndices[i]])
+
+        return self.sortResult(result)
+
+    @staticmethod
+    def sortResult(result):
+        # names in the order of their rules, x values in ascending order
+        return dict([(name, dict(sorted(byX.items(),
+                key=lambda item: (item[0] is not None, item[0] or 0))))
+                for (rule, name), byX in sorted(result.items())])
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagProfile(object):
+
+    # Phase timing and counters of the processing pipeline. Every phase
+    # (import, analyse, render, ...) accumulates its number of runs, wall
+    # clock and CPU time of this process, the number of microtags processed
+    # and the peak memory (RSS) of the process at its end. A hook runs
+    # selected phases (all if None) under cProfile or tracemalloc.
+
+    hooks = ['cprofile', 'tracemalloc']
+
+    def __init__(self):
+        # phase -> {'runs', 'wall', 'cpu', 'tags', 'peakRssKiB'}
+        self.phases = {}
+
+        # name -> value (see MicrotagList.getProfile())
+        self.counters = {}
+
+        self.hook = None
+        self.hookPhases = None
+        self.hookOutput = None
+        self.hookDepth = 0
+        self.profiler = None
+        self.hookReports = []
+
+    @staticmethod
+    def getPeakRss():
+        # peak resident set size of this process in KiB (None if unknown)
+        try:
+            import resource
+        except ImportError:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak
+
+    def setHook(self, hook, phases=None, output=None):
+        # output: file to dump cProfile statistics to (e.g. for snakeviz)
+        if hook is not None and hook not in self.hooks:
+            raise ValueError('Unknown profiling hook "{0}"'.format(hook))
+        self.hook = hook
+        self.hookPhases = None if phases is None else list(phases)
+        self.hookOutput = output
+
+    def isHooked(self, name):
+        return self.hook is not None and \
+                (self.hookPhases is None or name in self.hookPhases)
+
+    def begin(self, name):
+
+        # start timing a phase, returns the token to pass to end(...)
+
+        if self.isHooked(name):
+            self.hookDepth += 1
+            if self.hookDepth == 1:
+                if self.hook == 'cprofile':
+                    import cProfile
+                    if self.profiler is None:
+                        self.profiler = cProfile.Profile()
+                    self.profiler.enable()
+                else:
+                    import tracemalloc
+                    tracemalloc.start()
+
+        return (name, time.perf_counter(), time.process_time())
+
+    def end(self, token, nTags=None):
+
+        name, wall, cpu = token
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+
+        if self.isHooked(name):
+            self.hookDepth -= 1
+            if self.hookDepth == 0:
+                if self.hook == 'cprofile':
+                    self.profiler.disable()
+                else:
+                    import tracemalloc
+                    current, peak = tracemalloc.get_traced_memory()
+                    statistics = tracemalloc.take_snapshot().statistics('lineno')
+                    tracemalloc.stop()
+                    self.hookReports += ['tracemalloc of {0}: peak {1:,.1f} MiB, '
+                            'top allocations still held:'.format(name, peak / 1048576.)]
+                    self.hookReports += [TextFormatter.indent(str(stat))
+                            for stat in statistics[:10]]
+
+        if name not in self.phases:
+            self.phases[name] = {'runs': 0, 'wall': 0., 'cpu': 0., 'tags': 0,
+                    'peakRssKiB': None}
+        phase = self.phases[name]
+        phase['runs'] += 1
+        phase['wall'] += wall
+        phase['cpu'] += cpu
+        phase['tags'] += nTags or 0
+        phase['peakRssKiB'] = self.getPeakRss()
+
+    def getPhases(self):
+        return self.phases
+
+    def getCounters(self):
+        return self.counters
+
+    def getHookReport(self):
+
+        # report of the hook (top functions by cumulative time for cProfile),
+        # dumping the cProfile statistics to the output file if one was set
+
+        lines = list(self.hookReports)
+        if self.profiler is not None:
+            import pstats
+            f = io.StringIO()
+            pstats.Stats(self.profiler, stream=f).sort_stats('cumulative') \
+                    .print_stats(25)
+            lines += [f.getvalue().strip('\n')]
+            if self.hookOutput is not None:
+                self.profiler.dump_stats(self.hookOutput)
+                lines += ['Saved profile to {0}.'.format(self.hookOutput)]
+        return '\n'.join(lines)
+
+    def toDict(self):
+        return {'phases': dict([(name, dict(phase, tagsPerSecond=
+                phase['tags'] / phase['wall'] if phase['tags'] and phase['wall'] > 0
+                else None)) for name, phase in self.phases.items()]),
+                'counters': dict(self.counters)}
+
+    def writeJson(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.toDict(), f, indent=4)
+
+    def toLines(self):
+
+        # table of the phases (in the order they ran first) and the counters
+
+        header = ['phase', 'runs', 'wall [s]', 'cpu [s]', 'tags', 'tags/s',
+                'peak RSS']
+        rows = [[name, str(phase['runs']), '{0:.3f}'.format(phase['wall']),
+                '{0:.3f}'.format(phase['cpu']),
+                '{0:,}'.format(phase['tags']) if phase['tags'] else '-',
+                '{0:,.0f}'.format(phase['tags'] / phase['wall'])
+                        if phase['tags'] and phase['wall'] > 0 else '-',
+                '-' if phase['peakRssKiB'] is None else
+                        '{0:,.1f} MiB'.format(phase['peakRssKiB'] / 1024.)]
+                for name, phase in self.phases.items()]
+
+        widths = [max([len(row[i]) for row in rows + [header]])
+                for i in range(len(header))]
+        lines = ['  '.join(['{0:{1}}'.format(cell, width) if i == 0 else
+                '{0:>{1}}'.format(cell, width)
+                for i, (cell, width) in enumerate(zip(row, widths))])
+                for row in [header] + rows]
+
+        width = max([len(name) for name in self.counters] + [0])
+        lines += [''] * (len(self.counters) > 0)
+        lines += ['{0:{1}}  {2:,}'.format(name, width, value)
+                for name, value in self.counters.items()]
+
+        return lines
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagList(object):
+
+    def __init__(self, dataToTime=None, clockFrequency=None):
+
+        # columns of raw microtags
+        self.tagData = array('I')
+        self.tagIds = array('H')
+        self.rawTags = MicrotagSequence(self.tagData, self.makeRawTag)
+
+        # columns of analysed microtags (filled by analyse())
+        self.tagTypes = array('B')
+        self.aliasIndices = array('i')
+        self.partnerIndices = array('q')
+        self.aliases = []
+        self.analysedTags = None
+
+        # analyser state kept for incremental analysis
+        self.analyser = None
+
+        # extractor used by the last file import (line statistics)
+        self.extractor = None
+
+        # number of corrupted frames skipped by the last binary import
+        self.nBadFrames = 0
+
+        # first fragment index -> payload of reassembled vardata chains
+        self.varDataPayloads = {}
+
+        # indices of start tags without stop tag and stop tags without start tag
+        self.unmatchedStarts = array('q')
+        self.orphanStops = array('q')
+
+        self.tagDefDict = {}
+
+        # the tag definitions compiled by importTagDefsFromFile(...)
+        self.dispatchTable = None
+
+        # problems found in the tag definitions (see importTagDefsFromFile())
+        self.tagDefWarnings = []
+
+        # unwrapped ticks of analysed microtags (filled on demand by getTicks())
+        self.timeline = MicrotagTimeline(clockFrequency)
+        self.ticks = array('q')
+
+        # query indexes (built on demand by getIndex())
+        self.index = None
+
+        # phase timing and counters (see getProfile())
+        self.profile = MicrotagProfile()
+
+        # conversion function from (unwrapped) ticks to time
+        if dataToTime is not None:
+            self.dataToTime = dataToTime
+        else:
+            # the default is using ticks or seconds if a clock frequency is set
+            self.dataToTime = self.timeline.ticksToTime
+
+    def dataToTimeStr(self, data):
+        time = self.dataToTime(data)
+        return '{0:,.{2}f} {1}'.format(time[0], time[1], time[2]) 
+
+    def dataToTimeDiffStr(self, dataStart, dataStop):
+        timeStart = self.dataToTime(dataStart)
+        timeStop = self.dataToTime(dataStop)
+        return '{0:,.{2}f} {1}'.format(
+                timeStop[0] - timeStart[0], timeStop[1], timeStop[2])
+
+    def getTimeline(self):
+        return self.timeline
+
+    def resetTicks(self):
+        # forget the unwrapped ticks and indexes (after the analysed columns
+        # were replaced)
+        self.timeline.reset()
+        self.ticks = array('q')
+        self.index = None
+
+    def getTicks(self):
+        # unwrap the ticks of microtags analysed since the last call
+        nUnwrapped = len(self.ticks)
+        if nUnwrapped < len(self.tagTypes):
+            token = self.profile.begin('unwrap')
+            self.ticks.extend(self.timeline.unwrapBlock(
+                    self.tagData[nUnwrapped:len(self.tagTypes)],
+                    self.tagTypes[nUnwrapped:]))
+            self.profile.end(token, len(self.tagTypes) - nUnwrapped)
+        return self.ticks
+
+    def getTimes(self):
+        # time of every analysed microtag in seconds
+        return self.timeline.ticksToSeconds(self.getTicks())
+
+    def getDuration(self, startIndex, stopIndex):
+        # ticks elapsed between two analysed microtags (across any number of wraps)
+        ticks = self.getTicks()
+        return ticks[stopIndex] - ticks[startIndex]
+
+    def getIndex(self):
+        # (re)build the query indexes if tags were analysed since the last call
+        if self.index is None or self.index.nTags != len(self.tagTypes):
+            self.getTicks()
+            token = self.profile.begin('index')
+            self.index = MicrotagIndex(self)
+            self.profile.end(token, len(self.tagTypes))
+        return self.index
+
+    def findTags(self, idAlias=None, tagType=None, begin=None, end=None):
+        # indices of analysed microtags by alias, type code and time window
+        return self.getIndex().findTags(idAlias, tagType, begin, end)
+
+    def findSpans(self, idAlias=None, begin=None, end=None, minDuration=None,
+            maxDuration=None, overlapping=False):
+        # start tag indices of matched spans by alias, time window and duration
+        return self.getIndex().findSpans(idAlias, begin, end, minDuration,
+                maxDuration, overlapping)
+
+    def getSpanStats(self, groupBy=None):
+        # statistics of span durations per alias (and values of groupBy data tags)
+        stats = MicrotagSpanStats(self.aliases, groupBy)
+        self.getTicks()
+        token = self.profile.begin('spanStats')
+        stats.addList(self)
+        self.profile.end(token, len(self.tagTypes))
+        return stats
+
+    def getSpanTree(self):
+        # call tree of the matched spans with total and self time per path
+        tree = MicrotagSpanTree(self.aliases)
+        self.getTicks()
+        token = self.profile.begin('spanTree')
+        tree.addList(self)
+        self.profile.end(token, len(self.tagTypes))
+        return tree
+
+    def getProfile(self):
+        # phase timing with the counters updated to the current state
+        nStops = self.tagTypes.count(MicrotagType.STOP)
+        counters = self.profile.getCounters()
+        counters.clear()
+        counters['tags'] = len(self.tagData)
+        counters['analysedTags'] = len(self.tagTypes)
+        if self.extractor is not None:
+            counters['lines'] = self.extractor.getNumberOfLines()
+            counters['malformedLines'] = self.extractor.getNumberOfMalformedLines()
+        counters['badFrames'] = self.nBadFrames
+        counters['spans'] = nStops - len(self.orphanStops)
+        counters['unmatchedStarts'] = len(self.unmatchedStarts)
+        counters['orphanStops'] = len(self.orphanStops)
+        counters['varDataChains'] = len(self.varDataPayloads)
+        return self.profile
+
+    def getRawTags(self):
+        return self.rawTags
+
+    def getAnalysedTags(self):
+        return self.analysedTags
+
+    def makeRawTag(self, i):
+        tag = Microtag()
+        tag.tagData = self.tagData[i]
+        tag.tagId = self.tagIds[i]
+        return tag
+
+    def makeAnalysedTag(self, i):
+        tagType = self.tagTypes[i]
+        tag = MicrotagType.classes[tagType]()
+        tag.tagData = self.tagData[i]
+        tag.tagId = self.tagIds[i]
+        if self.aliasIndices[i] >= 0:
+            tag.setIdAlias(self.aliases[self.aliasIndices[i]])
+
+        partner = self.partnerIndices[i]
+        if tagType == MicrotagType.START:
+            if partner >= 0:
+                tag.setStopTagIndex(partner)
+        elif tagType == MicrotagType.STOP:
+            if partner >= 0:
+                tag.setStartTagIndex(partner)
+        elif tagType == MicrotagType.VARDATA:
+            # partner refers to the first fragment of the vardata chain
+            tag.setFragment(i - partner, self.tagData[partner] >> 24,
+                    self.varDataPayloads[partner])
+
+        return tag
+
+    def analyse(self, incremental=False):
+
+        # In incremental mode, only microtags appended since the last call
+        # are analysed, continuing from the state (open start tags, pending
+        # vardata chain) the previous call left behind
+
+        token = self.profile.begin('analyse')
+
+        if not incremental or self.analyser is None:
+            self.analyser = MicrotagAnalyser(self.tagDefDict, self.getDispatchTable())
+            self.tagTypes = array('B')
+            self.aliasIndices = array('i')
+            self.partnerIndices = array('q')
+            self.varDataPayloads = {}
+            self.analysedTags = MicrotagSequence(self.tagTypes, self.makeAnalysedTag)
+            self.resetTicks()
+
+        nAnalysed = len(self.tagTypes)
+        if nAnalysed == 0:
+            chunk = self.analyser.analyseBlock(self.tagData, self.tagIds)
+        else:
+            chunk = self.analyser.analyseBlock(
+                    self.tagData[nAnalysed:], self.tagIds[nAnalysed:])
+
+        self.tagTypes.extend(chunk.tagTypes)
+        self.aliasIndices.extend(chunk.aliasIndices)
+        self.partnerIndices.extend(chunk.partnerIndices)
+        self.varDataPayloads.update(chunk.varDataPayloads)
+        self.aliases = self.analyser.getAliases()
+
+        # link start tags analysed earlier to their newly found stop tags
+        for aliasIndex, start, stop, startData, stopData in chunk.getSpans():
+            if start < nAnalysed:
+                self.partnerIndices[start] = stop
+
+        self.orphanStops = self.analyser.getOrphanStops()
+        self.unmatchedStarts = self.analyser.getUnmatchedStarts()
+
+        self.profile.end(token, len(chunk))
+
+        # return the number of microtags analysed
+        return len(chunk)
+
+    def getUnmatchedStarts(self):
+        return self.unmatchedStarts
+
+    def getOrphanStops(self):
+        return self.orphanStops
+
+    def chunkToLines(self, chunk, aliases):
+
+        # one line per event, data tag and matched span of an analysed chunk
+        lines = []
+        spans = dict([(span[2], span) for span in chunk.getSpans()])
+
+        for i, tagType in enumerate(chunk.tagTypes, chunk.firstIndex):
+            data = chunk.tagData[i - chunk.firstIndex]
+            aliasIndex = chunk.aliasIndices[i - chunk.firstIndex]
+            if tagType == MicrotagType.EVENT:
+                lines += ['{0}: ! {1} {2}'.format(i,
+                        TextFormatter.makeBoldYellow(aliases[aliasIndex]),
+                        self.dataToTimeStr(data))]
+            elif tagType == MicrotagType.DATA:
+                lines += ['{0}: D {1} {2}'.format(i,
+                        TextFormatter.makeBoldBlue(aliases[aliasIndex]),
+                        TextFormatter.makeBoldBlue('[ 0x{0:08X} ]'.format(data)))]
+            elif tagType == MicrotagType.STOP and i in spans:
+                aliasIndex, start, stop, startData, stopData = spans[i]
+                lines += ['{0}: > {1} [ {2} ]---> {3}'.format(i,
+                        TextFormatter.makeBoldRed(aliases[aliasIndex]), start,
+                        self.dataToTimeDiffStr(0, MicrotagTimeline.tickDifference(
+                                startData, stopData)))]
+
+        return lines
+
+    def matchingReportStr(self):
+
+        # list unmatched start tags and orphan stop tags grouped by alias
+        lines = []
+        for name, indices in [('unmatched start', self.unmatchedStarts),
+                ('orphan stop', self.orphanStops)]:
+            if len(indices) == 0:
+                continue
+            lines += ['{0} {1} tag(s):'.format(len(indices), name)]
+            byAlias = {}
+            for j in indices:
+                byAlias.setdefault(self.aliases[self.aliasIndices[j]], []).append(j)
+            for idAlias in sorted(byAlias):
+                lines += [TextFormatter.indent('{0}: {1}'.format(idAlias,
+                        ', '.join([str(j) for j in byAlias[idAlias]])))]
+
+        return '\n'.join(lines)
+
+    def __len__(self):
+        return len(self.tagData)
+
+    def __str__(self):
+        # the table printed by microtags.py (use a MicrotagTextRenderer to
+        # write large lists to a file without building the whole string)
+        f = io.StringIO()
+        MicrotagTextRenderer(f).render(self)
+        return f.getvalue()[:-1]
+
+    def __iter__(self):
+        return iter(self.rawTags)
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            return self.rawTags[index]
+
+    def importTagsFromCodes(self, codes):
+        token = self.profile.begin('import')
+        lenBefore = len(self.tagData)
+        tagData, tagIds, invalid = MicrotagDecoder.decodeCodes(codes.split('\n'))
+        for code in invalid:
+            print('Invalid code "{0}"'.format(code))
+        self.tagData.extend(tagData)
+        self.tagIds.extend(tagIds)
+        self.profile.end(token, len(self.tagData) - lenBefore)
+        # return the number of tags imported
+        return len(self.tagData) - lenBefore
+
+    def importTagsFromFile(self, filename, chunkSize=None, useMmap=False,
+            prefix=None, pattern=None):
+        token = self.profile.begin('import')
+        lenBefore = len(self.tagData)
+        self.extractor = MicrotagExtractor(prefix, pattern)
+        for tagData, tagIds in MicrotagDecoder.iterCodeBlocks(
+                filename, chunkSize, useMmap, self.extractor):
+            self.tagData.extend(tagData)
+            self.tagIds.extend(tagIds)
+        self.profile.end(token, len(self.tagData) - lenBefore)
+        # return the number of tags imported
+        return len(self.tagData) - lenBefore
+
+    def importTagsFromBinaryFile(self, filename, chunkSize=None):
+        token = self.profile.begin('import')
+        lenBefore = len(self.tagData)
+        self.nBadFrames = 0
+        with MicrotagDecoder.openTrace(filename) as f:
+            for tagData, tagIds, nBadFrames in \
+                    MicrotagDecoder.iterFrameBlocks(f, chunkSize):
+                self.tagData.extend(tagData)
+                self.tagIds.extend(tagIds)
+                self.nBadFrames += nBadFrames
+        self.profile.end(token, len(self.tagData) - lenBefore)
+        # return the number of tags imported
+        return len(self.tagData) - lenBefore
+
+    def getNumberOfBadFrames(self):
+        return self.nBadFrames
+
+    def importTagDefsFromFile(self, filename):
+        token = self.profile.begin('tagDefs')
+        f = open(filename, 'r')
+        lines = [line.strip() for line in f]
+        tagDefs = [line for line in lines
+                if len(line) > 0 and line[0] != '#']
+        f.close()
+
+        nBefore = len(self.tagDefDict)
+
+        # changed definitions require analysing all microtags again
+        self.analyser = None
+
+        warnings = []
+        for tagDef in tagDefs:
+            tokens = [token.strip() for token in tagDef.split(',')]
+            if len(tokens) != 2:
+                # >>> invalid line >>>
+                continue
+            if not tokens[0].startswith('0x'):
+                # >>> invalid line >>>
+                continue
+
+            tagId = int(tokens[0][2:], base = 16)
+            if tagId in self.tagDefDict:
+                warnings += ['Tag id 0x{0:04X} is defined more than once '
+                        '("{1}" replaces "{2}")'.format(
+                                tagId, tokens[1], self.tagDefDict[tagId])]
+            self.tagDefDict[tagId] = tokens[1]
+
+        # compile the definitions once (validating them) for all analyses
+        self.dispatchTable = MicrotagDispatchTable(self.tagDefDict)
+        self.tagDefWarnings = warnings + self.dispatchTable.getWarnings()
+
+        self.profile.end(token)
+
+        return len(self.tagDefDict) - nBefore
+
+    def getTagDefWarnings(self):
+        return self.tagDefWarnings
+
+    def getDispatchTable(self):
+        # compiled tag definitions (compiled here if the definitions were
+        # not imported by importTagDefsFromFile(...))
+        if self.dispatchTable is None:
+            self.dispatchTable = MicrotagDispatchTable(self.tagDefDict)
+        return self.dispatchTable
+
+    def getExtractor(self):
+        return self.extractor
+
+    @staticmethod
+    def offsetIndices(column, offset):
+        # add offset to all valid (non-negative) indices of an array('q')
+        if haveNumpy(len(column)):
+            indices = numpy.frombuffer(column, dtype=numpy.int64).copy()
+            indices[indices >= 0] += offset
+            return array('q', indices.tobytes())
+        return array('q', [j + offset if j >= 0 else j for j in column])
+
+    @staticmethod
+    def analyseFileRange(filename, begin, end, tagDefDict, dispatchTable,
+            prefix, pattern):
+
+        # worker of importTagsFromFileParallel(...): decode and analyse a
+        # part of a trace file as if it was a trace on its own
+
+        extractor = MicrotagExtractor(prefix, pattern)
+        with open(filename, 'rb') as f:
+            f.seek(begin)
+            tagData, tagIds = extractor.extract(f.read(end - begin))
+
+        analyser = MicrotagAnalyser(tagDefDict, dispatchTable)
+        chunk = analyser.analyseBlock(tagData, tagIds)
+
+        return (chunk.tagData, chunk.tagIds, chunk.tagTypes, chunk.aliasIndices,
+                chunk.partnerIndices, chunk.varDataPayloads,
+                analyser.orphanStops, analyser.openStarts,
+                (analyser.lastType, analyser.lastAliasIndex, analyser.chainHead,
+                        analyser.chainLength, analyser.chainPayload),
+                (extractor.nLines, extractor.nCodes, extractor.nMalformed))
+
+    def importTagsFromFileParallel(self, filename, workers=None, prefix=None,
+            pattern=None):
+
+        # Imports and analyses a trace file using a pool of worker processes,
+        # each taking a newline-aligned part of the file. The results are
+        # stitched together such that they are identical to the ones of
+        # importTagsFromFile(...) followed by analyse().
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if not MicrotagDecoder.isSeekable(filename):
+            # >>> stdin or a compressed file cannot be split >>>
+            n = self.importTagsFromFile(filename, prefix=prefix, pattern=pattern)
+            self.analyse()
+            return n
+
+        import concurrent.futures
+
+        # the CPU time of the workers is not included in the profile
+        token = self.profile.begin('importParallel')
+
+        ranges = MicrotagDecoder.splitFile(filename, 4*workers)
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(MicrotagList.analyseFileRange, filename,
+                    begin, end, self.tagDefDict, self.getDispatchTable(), prefix,
+                    pattern) for begin, end in ranges]
+            results = [future.result() for future in futures]
+
+        self.extractor = MicrotagExtractor(prefix, pattern)
+
+        # the merging analyser carries the state across part boundaries,
+        # starting from the analysis of the microtags already in the list
+        lenBefore = len(self.tagData)
+        if lenBefore > 0:
+            self.analyse(incremental=True)
+            merger = self.analyser
+        else:
+            merger = MicrotagAnalyser(self.tagDefDict, self.getDispatchTable())
+            self.tagTypes = array('B')
+            self.aliasIndices = array('i')
+            self.partnerIndices = array('q')
+            self.varDataPayloads = {}
+            self.analysedTags = MicrotagSequence(self.tagTypes, self.makeAnalysedTag)
+            self.resetTicks()
+
+        for tagData, tagIds, tagTypes, aliasIndices, partnerIndices, payloads, \
+                orphanStops, openStarts, state, counts in results:
+
+            offset = len(self.tagData)
+            n = len(tagData)
+            partnerIndices = MicrotagList.offsetIndices(partnerIndices, offset)
+            payloads = dict([(head + offset, payload)
+                    for head, payload in payloads.items()])
+
+            # a vardata chain continued from the previous part has been taken
+            # for a new chain by the worker and needs to be analysed again
+            k = 0
+            if merger.lastType == MicrotagType.VARDATA and merger.chainHead >= 0 \
+                    and len(merger.chainPayload) < merger.chainLength:
+                while k < n and tagTypes[k] == MicrotagType.VARDATA and \
+                        aliasIndices[k] == merger.lastAliasIndex:
+                    k += 1
+            if k > 0:
+                merger.nTags = offset
+                chunk = merger.analyseBlock(tagData[:k], tagIds[:k])
+                partnerIndices[:k] = chunk.partnerIndices
+                payloads = dict([(head, payload) for head, payload
+                        in payloads.items() if head >= offset + k])
+                payloads.update(chunk.varDataPayloads)
+
+            # continue with the state the worker ended with
+            lastType, lastAliasIndex, chainHead, chainLength, chainPayload = state
+            if k < n:
+                merger.lastType = lastType
+                merger.lastAliasIndex = lastAliasIndex
+                if chainHead >= k:
+                    merger.chainHead = chainHead + offset
+                    merger.chainLength = chainLength
+                    merger.chainPayload = chainPayload
+
+            # stop tags without start tag in this part match open start tags
+            # from previous parts (these all precede the remaining starts)
+            for j in orphanStops:
+                stack = merger.openStarts.get(aliasIndices[j])
+                if stack:
+                    start, startData = stack.pop()
+                    partnerIndices[j] = start
+                    self.partnerIndices[start] = j + offset
+                else:
+                    merger.orphanStops.append(j + offset)
+            for aliasIndex, stack in openStarts.items():
+                merger.openStarts.setdefault(aliasIndex, []).extend(
+                        [(j + offset, data) for j, data in stack])
+
+            self.tagData.extend(tagData)
+            self.tagIds.extend(tagIds)
+            self.tagTypes.extend(tagTypes)
+            self.aliasIndices.extend(aliasIndices)
+            self.partnerIndices.extend(partnerIndices)
+            self.varDataPayloads.update(payloads)
+
+            self.extractor.nLines += counts[0]
+            self.extractor.nCodes += counts[1]
+            self.extractor.nMalformed += counts[2]
+
+        merger.nTags = len(self.tagData)
+        self.analyser = merger
+        self.aliases = merger.getAliases()
+        self.orphanStops = merger.getOrphanStops()
+        self.unmatchedStarts = merger.getUnmatchedStarts()
+
+        self.profile.end(token, len(self.tagData) - lenBefore)
+
+        # return the number of tags imported
+        return len(self.tagData) - lenBefore
+
+    def printList(self):
+        pass
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagRenderer(object):
+
+    # Writes the analysed microtags of a MicrotagList to a file object while
+    # they are formatted, batchSize lines at a time. Subclasses set up what
+    # can be computed once in begin(...) and format a single tag in
+    # formatTag(...).
+
+    batchSize = 4096
+
+    def __init__(self, f):
+        self.f = f
+
+    def begin(self, microtagList):
+        self.microtagList = microtagList
+        self.ticks = microtagList.getTicks()
+
+    def formatTag(self, i):
+        raise NotImplementedError()
+
+    def end(self):
+        pass
+
+    def render(self, microtagList):
+        self.begin(microtagList)
+        token = microtagList.profile.begin('render')
+        formatTag = self.formatTag
+        n = len(microtagList.tagTypes)
+        for first in range(0, n, self.batchSize):
+            self.f.write(''.join([formatTag(i) + '\n'
+                    for i in range(first, min(first + self.batchSize, n))]))
+        self.end()
+        microtagList.profile.end(token, n)
+
+    def getPayloadHex(self, i):
+        # hex string of the reassembled payload at the last fragment of a
+        # vardata chain (None for other fragments)
+        microtagList = self.microtagList
+        head = microtagList.partnerIndices[i]
+        length = microtagList.tagData[head] >> 24
+        end = min(length, 4*(i - head) + 3)
+        payload = microtagList.varDataPayloads[head]
+        if len(payload) < length or end < length:
+            return None
+        return payload.hex().upper()
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagTextRenderer(MicrotagRenderer):
+
+    # The coloured table printed by microtags.py. Column widths and the
+    # colour of every cell are resolved once per rendering: the TextFormatter
+    # helpers are applied to format templates instead of single values.
+
+    def __init__(self, f, useColor=None):
+        MicrotagRenderer.__init__(self, f)
+        self.useColor = TextFormatter.useColor if useColor is None else useColor
+
+    def begin(self, microtagList):
+        MicrotagRenderer.begin(self, microtagList)
+
+        useColor = TextFormatter.useColor
+        TextFormatter.useColor = self.useColor
+        try:
+            self.makeTemplates(microtagList)
+        finally:
+            TextFormatter.useColor = useColor
+
+    def makeTemplates(self, microtagList):
+
+        # determine length of longest string in tag id alias dictionary
+        # (removing leading type definitions, if present)
+        widthId = max([len(s if s.find(':') == -1 else s[s.find(':')+1:]) \
+                for s in list(microtagList.tagDefDict.values())] + [8]) + 4
+
+        # determine length of highest tag index
+        self.widthIndex = len('{0}'.format(len(microtagList.tagTypes)))
+
+        # type character and alias cell per type and alias index
+        colors = {
+                MicrotagType.START: ('<', TextFormatter.makeBoldGreen),
+                MicrotagType.STOP: ('>', TextFormatter.makeBoldRed),
+                MicrotagType.EVENT: ('!', TextFormatter.makeBoldYellow),
+                MicrotagType.DATA: ('D', TextFormatter.makeBoldBlue)}
+        self.aliasCells = {}
+        for tagType, (typeChar, makeColor) in colors.items():
+            self.aliasCells[tagType] = [typeChar + ' ' + makeColor(
+                    '{0:{1}}'.format(idAlias, widthId + 2))
+                    for idAlias in microtagList.aliases]
+        self.varDataCell = 'V ' + TextFormatter.makeBoldBlue(
+                '{{0:{0}}}'.format(widthId + 2))
+        self.untypedCell = '? {{0:{0}}}'.format(widthId + 2)
+
+        self.indexTemplate = '{{0:{0}}}: '.format(self.widthIndex)
+        self.timeTemplate = '{0:>25}  '
+        self.dataTemplate = TextFormatter.makeBoldBlue('[ 0x{0:08X} ]  ')
+        self.payloadTemplate = TextFormatter.makeBoldBlue('[ 0x{0} ]')
+        self.morePayload = TextFormatter.makeBoldBlue('...')
+        self.startTemplate = '--->[ {{0:{0}}} ]'.format(self.widthIndex)
+        self.stopTemplates = ['[ {{0:{0}}} ]---({1:^{2}})--->[ {{1:{0}}} ]'.format(
+                self.widthIndex, idAlias, widthId) for idAlias in microtagList.aliases]
+        self.durationTemplate = '{0:>20}'
+
+    def formatTag(self, i):
+
+        microtagList = self.microtagList
+        tagType = microtagList.tagTypes[i]
+        aliasIndex = microtagList.aliasIndices[i]
+        line = self.indexTemplate.format(i)
+
+        if tagType == MicrotagType.VARDATA:
+            partner = microtagList.partnerIndices[i]
+            line += self.varDataCell.format('{0}<{1}>'.format(
+                    microtagList.aliases[aliasIndex], i - partner))
+            payload = self.getPayloadHex(i)
+            line += self.morePayload if payload is None else \
+                    self.payloadTemplate.format(payload)
+            return line
+
+        if tagType == MicrotagType.UNTYPED:
+            line += self.untypedCell.format(microtagList.aliases[aliasIndex]
+                    if aliasIndex >= 0 else '[0x{0:04X}]'.format(microtagList.tagIds[i]))
+        else:
+            line += self.aliasCells[tagType][aliasIndex]
+
+        if tagType == MicrotagType.UNTYPED or tagType == MicrotagType.DATA:
+            return line + self.dataTemplate.format(microtagList.tagData[i])
+
+        line += self.timeTemplate.format(microtagList.dataToTimeStr(self.ticks[i]))
+
+        partner = microtagList.partnerIndices[i]
+        if tagType == MicrotagType.START:
+            line += self.startTemplate.format('-' if partner < 0 else str(partner))
+        elif tagType == MicrotagType.STOP:
+            line += self.stopTemplates[aliasIndex].format(
+                    '-' if partner < 0 else str(partner), i)
+            if partner >= 0:
+                line += self.durationTemplate.format(microtagList.dataToTimeDiffStr(
+                        self.ticks[partner], self.ticks[i]))
+
+        return line
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagRecordRenderer(MicrotagRenderer):
+
+    # Base of the machine-readable renderers: one record per microtag with
+    # the fields listed in columns (None where a field does not apply)
+
+    columns = ['index', 'id', 'type', 'alias', 'data', 'ticks', 'time',
+            'partner', 'duration', 'payload']
+
+    def makeRecord(self, i):
+        microtagList = self.microtagList
+        tagType = microtagList.tagTypes[i]
+        aliasIndex = microtagList.aliasIndices[i]
+        partner = microtagList.partnerIndices[i]
+
+        record = [i, microtagList.tagIds[i], MicrotagType.names[tagType],
+                microtagList.aliases[aliasIndex] if aliasIndex >= 0 else None,
+                microtagList.tagData[i], None, None, None, None, None]
+
+        if MicrotagType.START <= tagType <= MicrotagType.EVENT:
+            record[5] = self.ticks[i]
+            record[6] = microtagList.dataToTime(self.ticks[i])[0]
+            if partner >= 0 and tagType != MicrotagType.EVENT:
+                record[7] = partner
+                if tagType == MicrotagType.STOP:
+                    record[8] = self.ticks[i] - self.ticks[partner]
+        elif tagType == MicrotagType.VARDATA:
+            record[7] = partner
+            record[9] = self.getPayloadHex(i)
+
+        return record
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagCsvRenderer(MicrotagRecordRenderer):
+
+    def begin(self, microtagList):
+        MicrotagRecordRenderer.begin(self, microtagList)
+        self.f.write(','.join(self.columns) + '\n')
+
+    def formatTag(self, i):
+        # none of the fields can contain commas or quotes except the alias
+        record = self.makeRecord(i)
+        if record[3] is not None and (',' in record[3] or '"' in record[3]):
+            record[3] = '"{0}"'.format(record[3].replace('"', '""'))
+        return ','.join(['' if value is None else str(value) for value in record])
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagJsonRenderer(MicrotagRecordRenderer):
+
+    # JSON Lines: one object per microtag
+
+    def formatTag(self, i):
+        return json.dumps(dict(zip(self.columns, self.makeRecord(i))))
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagCache(object):
+
+    # An on-disk cache of decoded and analysed traces. Entries are keyed by
+    # a hash of the contents of the trace file and the tag definition file
+    # (so they become invalid whenever either changes) and hold the columns
+    # of a MicrotagList in a binary file that is read straight into the
+    # arrays on loading. The least recently used entries are evicted to keep
+    # the cache directory below a given size.
+
+    magic = b'MTCACHE2'
+
+    # the columns stored in a cache entry: those of a MicrotagList, followed
+    # by the payloads of variable data chains (their heads, the end offset of
+    # every payload and all payloads one after another)
+    listColumns = [('tagData', 'I'), ('tagIds', 'H'), ('tagTypes', 'B'),
+            ('aliasIndices', 'i'), ('partnerIndices', 'q'), ('orphanStops', 'q'),
+            ('unmatchedStarts', 'q')]
+    columns = listColumns + [('payloadHeads', 'q'), ('payloadEnds', 'q'),
+            ('payloadBytes', 'B')]
+
+    def __init__(self, directory=None, maxBytes=1 << 30):
+        if directory is None:
+            directory = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                    os.path.join(os.path.expanduser('~'), '.cache')), 'microtags')
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+    def getDirectory(self):
+        return self.directory
+
+    @staticmethod
+    def hashFile(h, filename):
+        with open(filename, 'rb') as f:
+            while True:
+                block = f.read(1 << 20)
+                if len(block) == 0:
+                    break
+                h.update(block)
+
+    def getKey(self, tagDefFilename, tagsFilename, prefix=None, pattern=None,
+            binary=False):
+        h = hashlib.blake2b(digest_size=20)
+        h.update(MicrotagCache.magic)
+        h.update(repr((prefix, pattern, binary)).encode('utf-8'))
+        for filename in [tagDefFilename, tagsFilename]:
+            MicrotagCache.hashFile(h, filename)
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def getEntryFilename(self, key):
+        return os.path.join(self.directory, key + '.mtc')
+
+    @staticmethod
+    def readEntry(f):
+
+        # Reads the cache entry in binary file f and returns the tuple
+        # (columns, varDataPayloads, meta) with columns being a dictionary of
+        # arrays. Raises ValueError if the entry is truncated or malformed.
+
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(12)
+        if len(head) < 12 or head[:8] != MicrotagCache.magic:
+            raise ValueError('Not a microtag cache entry')
+        length = int.from_bytes(head[8:], byteorder='little')
+        if 12 + length > size:
+            raise ValueError('Truncated microtag cache entry')
+        meta = json.loads(f.read(length).decode('utf-8'))
+        if len(meta['columns']) != len(MicrotagCache.columns):
+            raise ValueError('Unexpected columns in microtag cache entry')
+
+        columns = {}
+        end = 12 + length
+        for (name, typecode), (storedName, storedTypecode, offset, count) in \
+                zip(MicrotagCache.columns, meta['columns']):
+            column = array(typecode)
+            nBytes = count*column.itemsize
+            if storedName != name or storedTypecode != typecode \
+                    or count < 0 or offset < end or offset + nBytes > size:
+                raise ValueError('Invalid column "{0}" in microtag cache entry'
+                        .format(storedName))
+            column = array(typecode, [0]) * count
+            f.seek(offset)
+            if f.readinto(memoryview(column).cast('B')) != nBytes:
+                raise ValueError('Truncated microtag cache entry')
+            if meta['byteorder'] != sys.byteorder:
+                column.byteswap()
+            columns[name] = column
+            end = offset + nBytes
+
+        # payloads of variable data chains
+        heads = columns.pop('payloadHeads')
+        ends = columns.pop('payloadEnds')
+        payloadBytes = memoryview(columns.pop('payloadBytes'))
+        if len(ends) != len(heads):
+            raise ValueError('Invalid payloads in microtag cache entry')
+        varDataPayloads = {}
+        start = 0
+        for head, end in zip(heads, ends):
+            if end < start or end > len(payloadBytes):
+                raise ValueError('Invalid payloads in microtag cache entry')
+            varDataPayloads[head] = bytes(payloadBytes[start:end])
+            start = end
+
+        return columns, varDataPayloads, meta
+
+    def load(self, microtagList, key):
+
+        # Restores the raw and analysed columns of microtagList from the
+        # cache entry with the given key. Returns False if there is none. A
+        # damaged entry is removed (to be rewritten by store(...)) and treated
+        # as if there was none.
+
+        filename = self.getEntryFilename(key)
+        try:
+            f = open(filename, 'rb')
+        except OSError:
+            return False
+
+        try:
+            with f:
+                columns, varDataPayloads, meta = MicrotagCache.readEntry(f)
+            aliases = meta['aliases']
+            nLines, nCodes, nMalformed = meta['extractor']
+        except (OSError, ValueError, KeyError, TypeError):
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+            return False
+
+        for name, column in columns.items():
+            setattr(microtagList, name, column)
+        microtagList.aliases = aliases
+        microtagList.varDataPayloads = varDataPayloads
+        microtagList.analysedTags = MicrotagSequence(
+                microtagList.tagTypes, microtagList.makeAnalysedTag)
+        microtagList.rawTags = MicrotagSequence(
+                microtagList.tagData, microtagList.makeRawTag)
+        microtagList.resetTicks()
+        microtagList.analyser = None
+
+        extractor = MicrotagExtractor()
+        extractor.nLines, extractor.nCodes, extractor.nMalformed = \
+                nLines, nCodes, nMalformed
+        microtagList.extractor = extractor
+
+        # mark the entry as recently used
+        os.utime(filename)
+        return True
+
+    def store(self, microtagList, key):
+
+        # Writes the columns of an analysed microtagList to the cache entry
+        # with the given key and evicts old entries if needed
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        columns = {}
+        for name, typecode in MicrotagCache.listColumns:
+            columns[name] = getattr(microtagList, name)
+        payloads = microtagList.varDataPayloads
+        columns['payloadHeads'] = array('q', sorted(payloads))
+        columns['payloadEnds'] = array('q')
+        end = 0
+        for head in columns['payloadHeads']:
+            end += len(payloads[head])
+            columns['payloadEnds'].append(end)
+        columns['payloadBytes'] = array('B',
+                b''.join([payloads[head] for head in columns['payloadHeads']]))
+
+        extractor = microtagList.getExtractor() or MicrotagExtractor()
+        meta = {
+            'byteorder': sys.byteorder,
+            'aliases': microtagList.aliases,
+            'extractor': [extractor.nLines, extractor.nCodes, extractor.nMalformed],
+            'columns': []}
+
+        # columns start at an offset aligned to 8 bytes after the header,
+        # whose length depends on the offsets themselves
+        headerLength = 0
+        while True:
+            offset = (12 + headerLength + 7) & ~7
+            meta['columns'] = []
+            for name, typecode in MicrotagCache.columns:
+                column = columns[name]
+                meta['columns'] += [[name, column.typecode, offset, len(column)]]
+                offset += (len(column)*column.itemsize + 7) & ~7
+            header = json.dumps(meta).encode('utf-8')
+            if len(header) == headerLength:
+                break
+            headerLength = len(header)
+
+        fd, tmpFilename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(MicrotagCache.magic)
+                f.write(len(header).to_bytes(4, byteorder='little'))
+                f.write(header)
+                for name, typecode, offset, count in meta['columns']:
+                    f.write(b'\0' * (offset - f.tell()))
+                    columns[name].tofile(f)
+            os.replace(tmpFilename, self.getEntryFilename(key))
+        except BaseException:
+            os.unlink(tmpFilename)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        # remove least recently used entries until the cache fits into maxBytes
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.mtc'):
+                st = os.stat(os.path.join(self.directory, name))
+                entries += [(st.st_mtime, st.st_size, name)]
+        total = sum([size for mtime, size, name in entries])
+        for mtime, size, name in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            os.unlink(os.path.join(self.directory, name))
+            total -= size
+
+    def importAndAnalyse(self, microtagList, tagDefFilename, tagsFilename,
+            prefix=None, pattern=None, workers=1, binary=False):
+
+        # Imports and analyses a trace file into microtagList (whose tag
+        # definitions have to be imported already) unless it is cached.
+        # Returns (number of microtags, whether the cache was hit).
+
+        # stdin can be read only once and is never cached
+        key = None
+        if tagsFilename != '-':
+            key = self.getKey(tagDefFilename, tagsFilename, prefix, pattern, binary)
+            token = microtagList.profile.begin('cacheLoad')
+            hit = self.load(microtagList, key)
+            microtagList.profile.end(token, len(microtagList) if hit else None)
+            if hit:
+                return len(microtagList), True
+
+        if binary:
+            n = microtagList.importTagsFromBinaryFile(tagsFilename)
+            microtagList.analyse()
+        elif workers > 1:
+            n = microtagList.importTagsFromFileParallel(tagsFilename, workers,
+                    prefix=prefix, pattern=pattern)
+        else:
+            n = microtagList.importTagsFromFile(tagsFilename,
+                    prefix=prefix, pattern=pattern)
+            microtagList.analyse()
+        if key is not None:
+            token = microtagList.profile.begin('cacheStore')
+            self.store(microtagList, key)
+            microtagList.profile.end(token, n)
+        return n, False
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagStream(object):
+
+    # Decodes and analyses a trace file chunk by chunk without keeping all
+    # microtags in memory. Peak memory depends on the chunk size and the
+    # number of open start tags, but not on the size of the file.
+
+    def __init__(self, tagDefDict, chunkSize=None, useMmap=False, extractor=None):
+        self.analyser = MicrotagAnalyser(tagDefDict)
+        self.extractor = extractor if extractor is not None else MicrotagExtractor()
+        self.chunkSize = chunkSize
+        self.useMmap = useMmap
+
+    def getAnalyser(self):
+        return self.analyser
+
+    def getExtractor(self):
+        return self.extractor
+
+    def getAliases(self):
+        return self.analyser.getAliases()
+
+    def iterFile(self, filename):
+        # yields one analysed MicrotagChunk per chunk read from the file
+        for tagData, tagIds in MicrotagDecoder.iterCodeBlocks(
+                filename, self.chunkSize, self.useMmap, self.extractor):
+            yield self.analyser.analyseBlock(tagData, tagIds)
+
+    def iterSpans(self, filename):
+        # yields matched spans as (alias, start index, stop index, start data, stop data)
+        aliases = self.analyser.getAliases()
+        for chunk in self.iterFile(filename):
+            for aliasIndex, start, stop, startData, stopData in chunk.getSpans():
+                yield aliases[aliasIndex], start, stop, startData, stopData
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagBatch(object):
+
+    # Summarises many trace files sharing the same tag definitions using a
+    # pool of worker processes (one trace file per task, all CPUs if workers
+    # is None) or in this process if workers is 1
+
+    def __init__(self, tagDefDict, workers=None, prefix=None, pattern=None,
+            groupBy=None):
+        self.tagDefDict = tagDefDict
+        self.workers = workers
+        self.prefix = prefix
+        self.pattern = pattern
+        self.groupBy = groupBy
+
+    @staticmethod
+    def expandPatterns(patterns):
+        # expand glob patterns into a sorted list of unique filenames
+        filenames = set()
+        for pattern in patterns:
+            matches = glob.glob(pattern)
+            filenames.update(matches if len(matches) > 0 else [pattern])
+        return sorted(filenames)
+
+    @staticmethod
+    def summariseFile(filename, tagDefDict, prefix=None, pattern=None,
+            groupBy=None):
+
+        # Returns a summary of a single trace file as a dictionary. Spans
+        # are summarised per alias (and grouping values) as MicrotagStats.
+
+        summary = {'file': filename, 'tags': 0, 'malformed': 0,
+                'unmatchedStarts': 0, 'orphanStops': 0, 'spans': {},
+                'error': None}
+
+        try:
+            stream = MicrotagStream(tagDefDict,
+                    extractor=MicrotagExtractor(prefix, pattern))
+            spanStats = MicrotagSpanStats(stream.getAliases(), groupBy)
+            for chunk in stream.iterFile(filename):
+                spanStats.addChunk(chunk)
+            for (idAlias, state), stats in spanStats.getGroups().items():
+                summary['spans'][spanStats.groupToStr(idAlias, state)] = stats
+
+            analyser = stream.getAnalyser()
+            summary['tags'] = analyser.nTags
+            summary['malformed'] = stream.getExtractor().getNumberOfMalformedLines()
+            summary['unmatchedStarts'] = len(analyser.getUnmatchedStarts())
+            summary['orphanStops'] = len(analyser.getOrphanStops())
+        except Exception as e:
+            summary['error'] = str(e)
+
+        return summary
+
+    def run(self, patterns):
+        # returns the summaries of all files matching the glob patterns
+        filenames = MicrotagBatch.expandPatterns(patterns)
+        if self.workers is not None and self.workers <= 1:
+            return [MicrotagBatch.summariseFile(filename, self.tagDefDict,
+                    self.prefix, self.pattern, self.groupBy)
+                    for filename in sorted(filenames, key=lambda f: f != '-')]
+
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as executor:
+            futures = [executor.submit(MicrotagBatch.summariseFile, filename,
+                    self.tagDefDict, self.prefix, self.pattern, self.groupBy)
+                    for filename in filenames if filename != '-']
+            # stdin is read by this process (workers do not inherit it)
+            summaries = [MicrotagBatch.summariseFile(filename, self.tagDefDict,
+                    self.prefix, self.pattern, self.groupBy)
+                    for filename in filenames if filename == '-']
+            return summaries + [future.result() for future in futures]
+
+    @staticmethod
+    def summariesToLines(summaries, dataToTime=None):
+
+        # merge summaries into one table with a row per file and alias
+
+        if dataToTime is None:
+            dataToTime = lambda c: (c, 'ticks', 0)
+        timeStr = lambda t: '{0:,.{1}f}'.format(t[0], t[2])
+
+        header = ['file', 'alias', 'count', 'min', 'mean', 'stddev', 'p50',
+                'p95', 'p99', 'max', 'tags', 'malformed', 'unmatched', 'orphans',
+                'error']
+        rows = []
+        for summary in summaries:
+            counts = [str(summary['tags']), str(summary['malformed']),
+                    str(summary['unmatchedStarts']), str(summary['orphanStops']),
+                    summary['error'] or '']
+            if len(summary['spans']) == 0:
+                rows += [[summary['file'], '-', '0'] + ['']*7 + counts]
+            for idAlias, stats in summary['spans'].items():
+                rows += [[summary['file'], idAlias, str(stats.getCount())] +
+                        [timeStr(dataToTime(value)) for value in [
+                                stats.getMinimum(), stats.getMean(),
+                                stats.getStdDev()] +
+                                [stats.getQuantile(q) for q in MicrotagStats.quantiles] +
+                                [stats.getMaximum()]] + counts]
+
+        widths = [max([len(row[i]) for row in rows + [header]])
+                for i in range(len(header))]
+        lines = []
+        for row in [header] + rows:
+            lines += ['  '.join(['{0:{1}}'.format(cell, width) if i < 2 else
+                    '{0:>{1}}'.format(cell, width)
+                    for i, (cell, width) in enumerate(zip(row[:-1], widths))]
+                    + [row[-1]]).rstrip()]
+
+        return lines
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagComparison(object):
+
+    # Compares the span durations of a candidate trace with the ones of a
+    # baseline trace, group by group (a group is an alias, possibly with the
+    # values of groupBy data tags, see MicrotagSpanStats.groupToStr(...)).
+    # The difference of the means gets a confidence interval and a p-value
+    # from Welch's t-test. A group regressed if even the lower bound of the
+    # interval is slower than the baseline by more than threshold (relative
+    # to the baseline mean) and improved if the upper bound is faster by
+    # more than threshold. Other significant differences count as changed.
+
+    def __init__(self, baseline, candidate, confidence=0.95, threshold=0.05):
+        # baseline, candidate: group -> MicrotagStats
+        self.baseline = baseline
+        self.candidate = candidate
+        self.confidence = confidence
+        self.threshold = threshold
+        self.rows = self.compare()
+
+    @staticmethod
+    def betaRegularized(a, b, x):
+        # regularized incomplete beta function I_x(a, b) (continued fraction)
+        if x <= 0.:
+            return 0.
+        if x >= 1.:
+            return 1.
+        if x > (a + 1.) / (a + b + 2.):
+            return 1. - MicrotagComparison.betaRegularized(b, a, 1. - x)
+        front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                a * math.log(x) + b * math.log1p(-x)) / a
+        tiny = 1e-300
+        f, c, d = 1., 1., 0.
+        for i in range(400):
+            m = i // 2
+            if i == 0:
+                numerator = 1.
+            elif i % 2 == 0:
+                numerator = m * (b - m) * x / ((a + 2*m - 1) * (a + 2*m))
+            else:
+                numerator = -(a + m) * (a + b + m) * x / ((a + 2*m) * (a + 2*m + 1))
+            d = 1. + numerator * d
+            d = 1. / (d if abs(d) > tiny else tiny)
+            c = 1. + numerator / (c if abs(c) > tiny else tiny)
+            f *= c * d
+            if abs(1. - c * d) < 1e-14:
+                break
+        return front * (f - 1.)
+
+    @staticmethod
+    def tSurvival(t, df):
+        # P(T > t) for Student's t-distribution with df degrees of freedom
+        tail = 0.5 * MicrotagComparison.betaRegularized(df / 2., 0.5, df / (df + t * t))
+        return tail if t >= 0 else 1. - tail
+
+    @staticmethod
+    def tQuantile(p, df):
+
+        # quantile of Student's t-distribution: Newton's method on the
+        # survival function, starting from the normal quantile
+
+        if p < 0.5:
+            return -MicrotagComparison.tQuantile(1. - p, df)
+        if p == 0.5:
+            return 0.
+        import statistics
+        z = statistics.NormalDist().inv_cdf(p)
+        t = z + (z**3 + z) / (4. * df)
+        logNorm = math.lgamma((df + 1.) / 2.) - math.lgamma(df / 2.) - \
+                0.5 * math.log(df * math.pi)
+        for i in range(50):
+            density = math.exp(logNorm - (df + 1.) / 2. * math.log1p(t * t / df))
+            step = (MicrotagComparison.tSurvival(t, df) - (1. - p)) / density
+            t = max(t + step, t / 2.)
+            if abs(step) < 1e-12 * t:
+                break
+        return t
+
+    def compare(self):
+
+        # rows as dictionaries, ranked from the strongest regression (by the
+        # lower bound of the relative difference) to the strongest improvement
+
+        groups = [group for group in self.baseline if group in self.candidate]
+        columns = [[float(stats[group].getCount()), stats[group].getMean(),
+                stats[group].getVariance()] for stats in [self.baseline,
+                self.candidate] for group in groups]
+        n = len(groups)
+
+        # difference of the means, its standard error and the degrees of
+        # freedom (Welch-Satterthwaite) per group, nan if not defined
+        if haveNumpy() and n > 0:
+            values = numpy.array(columns, dtype=float).reshape(2, n, 3)
+            n1, m1, v1 = values[0].T
+            n2, m2, v2 = values[1].T
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                s1 = v1 / n1
+                s2 = v2 / n2
+                df = (s1 + s2)**2 / (s1**2 / (n1 - 1) + s2**2 / (n2 - 1))
+                valid = (n1 > 1) & (n2 > 1) & (m1 > 0)
+                df = numpy.where(valid & numpy.isfinite(df), numpy.maximum(df, 1.),
+                        numpy.where(valid, numpy.inf, numpy.nan))
+                deltas = (m2 - m1).tolist()
+                means = m1.tolist()
+                errors = numpy.sqrt(s1 + s2).tolist()
+                dfs = df.tolist()
+        else:
+            deltas, means, errors, dfs = [], [], [], []
+            for k in range(n):
+                (n1, m1, v1), (n2, m2, v2) = columns[k], columns[n + k]
+                deltas.append(m2 - m1)
+                means.append(m1)
+                if n1 > 1 and n2 > 1 and m1 > 0:
+                    s1, s2 = v1 / n1, v2 / n2
+                    errors.append(math.sqrt(s1 + s2))
+                    dfs.append(max((s1 + s2)**2 / (s1**2 / (n1 - 1) +
+                            s2**2 / (n2 - 1)), 1.) if s1 + s2 > 0 else math.inf)
+                else:
+                    errors.append(math.nan)
+                    dfs.append(math.nan)
+
+        # confidence interval of the relative difference and p-value of
+        # Welch's t-test (zero variance in both traces: exact difference)
+        quantiles = {}
+        relative, lower, upper, pValues = [], [], [], []
+        for delta, mean, error, df in zip(deltas, means, errors, dfs):
+            relative.append(delta / mean if mean > 0 else math.nan)
+            if math.isnan(df):
+                lower.append(math.nan)
+                upper.append(math.nan)
+                pValues.append(math.nan)
+                continue
+            if math.isinf(df):
+                half = 0.
+                pValues.append(0. if delta != 0 else 1.)
+            else:
+                if df not in quantiles:
+                    quantiles[df] = self.tQuantile(0.5 + self.confidence / 2., df)
+                half = quantiles[df] * error
+                pValues.append(2. * self.tSurvival(abs(delta) / error, df))
+            lower.append((delta - half) / mean)
+            upper.append((delta + half) / mean)
+
+        rows = []
+        for k, group in enumerate(groups):
+            if math.isnan(lower[k]):
+                status = 'insufficient'
+            elif lower[k] > self.threshold:
+                status = 'regression'
+            elif upper[k] < -self.threshold:
+                status = 'improvement'
+            elif pValues[k] < 1. - self.confidence:
+                status = 'changed'
+            else:
+                status = 'unchanged'
+            rows.append({'group': group, 'status': status,
+                    'baselineCount': self.baseline[group].getCount(),
+                    'candidateCount': self.candidate[group].getCount(),
+                    'baselineMean': self.baseline[group].getMean(),
+                    'candidateMean': self.candidate[group].getMean(),
+                    'delta': deltas[k], 'relative': relative[k],
+                    'lower': lower[k], 'upper': upper[k], 'pValue': pValues[k]})
+        rows.sort(key=lambda row: (math.isnan(row['lower']),
+                -row['lower'] if not math.isnan(row['lower']) else 0, row['group']))
+
+        # groups found in only one of the traces
+        rows += [{'group': group, 'status': 'missing',
+                'baselineCount': self.baseline[group].getCount(),
+                'candidateCount': 0, 'baselineMean': self.baseline[group].getMean(),
+                'candidateMean': None, 'delta': None, 'relative': None,
+                'lower': None, 'upper': None, 'pValue': None}
+                for group in self.baseline if group not in self.candidate]
+        rows += [{'group': group, 'status': 'new', 'baselineCount': 0,
+                'candidateCount': self.candidate[group].getCount(),
+                'baselineMean': None, 'candidateMean': self.candidate[group].getMean(),
+                'delta': None, 'relative': None, 'lower': None, 'upper': None,
+                'pValue': None}
+                for group in self.candidate if group not in self.baseline]
+
+        return rows
+
+    def getRows(self):
+        return self.rows
+
+    def getRegressions(self):
+        return [row for row in self.rows if row['status'] == 'regression']
+
+    def toDict(self):
+        # JSON-friendly (NaN bounds of insufficient groups become None)
+        return {'confidence': self.confidence, 'threshold': self.threshold,
+                'regressions': len(self.getRegressions()),
+                'groups': [dict([(key, None if isinstance(value, float) and
+                        math.isnan(value) else value) for key, value in row.items()])
+                        for row in self.rows]}
+
+    def toLines(self, dataToTime=None):
+
+        # ranked table with the means, their difference and its interval
+
+        if dataToTime is None:
+            dataToTime = lambda c: (c, 'ticks', 0)
+        timeStr = lambda v: '-' if v is None else \
+                '{0:,.{1}f}'.format(dataToTime(v)[0], dataToTime(v)[2])
+        percentStr = lambda v: '-' if v is None or math.isnan(v) else \
+                '{0:+.1f}%'.format(100. * v)
+
+        header = ['group', 'n base', 'n cand', 'base mean', 'cand mean', 'delta',
+                'change', 'interval', 'p', 'status']
+        rows = [[row['group'], str(row['baselineCount']), str(row['candidateCount']),
+                timeStr(row['baselineMean']), timeStr(row['candidateMean']),
+                '-' if row['delta'] is None else '{0:+,.{1}f}'.format(
+                        dataToTime(row['delta'])[0], dataToTime(row['delta'])[2]),
+                percentStr(row['relative']),
+                '-' if row['lower'] is None or math.isnan(row['lower']) else
+                        '[{0}, {1}]'.format(percentStr(row['lower']),
+                                percentStr(row['upper'])),
+                '-' if row['pValue'] is None or math.isnan(row['pValue']) else
+                        '{0:.3g}'.format(row['pValue']),
+                row['status']] for row in self.rows]
+
+        widths = [max([len(row[i]) for row in rows + [header]])
+                for i in range(len(header))]
+        lines = ['  '.join(['{0:{1}}'.format(cell, width) if i == 0 else
+                '{0:>{1}}'.format(cell, width)
+                for i, (cell, width) in enumerate(zip(row[:-1], widths))]
+                + [row[-1]]).rstrip() for row in [header] + rows]
+        lines += ['{0} regression(s) of more than {1:.1f}% at {2:.0f}% confidence.'
+                .format(len(self.getRegressions()), 100. * self.threshold,
+                        100. * self.confidence)]
+        return lines
+
+
+#
+# _____________________________________________________________________________
+#
+class MicrotagLiveReader(object):
+
+    # Reads microtags from a serial device, pty or FIFO while they arrive.
+    # Bytes are drained from the device as soon as it is readable and kept
+    # in a buffer, so a slow consumer delays microtags but never makes us
+    # drop any. Decoded and analysed chunks are handed to the consumer via
+    # a bounded queue; while the queue is full, lines accumulate in the
+    # buffer and are decoded as one larger chunk later on. With binary set,
+    # the input is taken as frames of binary flushes instead of text.
+
+    def __init__(self, tagDefDict, device, baudRate=None, queueSize=16,
+            extractor=None, binary=False):
+        self.analyser = MicrotagAnalyser(tagDefDict)
+        self.extractor = extractor if extractor is not None else MicrotagExtractor()
+        self.binary = binary
+        self.device = device
+        self.baudRate = baudRate
+        self.queueSize = queueSize
+
+        self.buffer = bytearray()
+        self.dataAvailable = None
+        self.eof = False
+
+        # statistics
+        self.nBytes = 0
+        self.nBadFrames = 0
+        self.maxBuffered = 0
+
+    def getAnalyser(self):
+        return self.analyser
+
+    def getExtractor(self):
+        return self.extractor
+
+    def getAliases(self):
+        return self.analyser.getAliases()
+
+    def getNumberOfBytes(self):
+        return self.nBytes
+
+    def getNumberOfBadFrames(self):
+        return self.nBadFrames
+
+    def getMaxBuffered(self):
+        return self.maxBuffered
+
+    async def openDevice(self):
+        import asyncio
+        if stat.S_ISFIFO(os.stat(self.device).st_mode):
+            # opening a FIFO blocks until there is a writer
+            fd = await asyncio.get_running_loop().run_in_executor(
+                    None, os.open, self.device, os.O_RDONLY)
+            os.set_blocking(fd, False)
+        else:
+            fd = os.open(self.device,
+                    os.O_RDONLY | os.O_NONBLOCK | getattr(os, 'O_NOCTTY', 0))
+        if self.baudRate is not None:
+            self.configureSerial(fd)
+        return fd
+
+    def configureSerial(self, fd):
+        import tty
+        import termios
+        speed = getattr(termios, 'B{0}'.format(self.baudRate), None)
+        if speed is None:
+            raise Exception('Unsupported baud rate {0}'.format(self.baudRate))
+        tty.setraw(fd)
+        attributes = termios.tcgetattr(fd)
+        attributes[2] |= termios.CLOCAL | termios.CREAD
+        attributes[4] = speed
+        attributes[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+
+    def onReadable(self, fd):
+        import asyncio
+        try:
+            data = os.read(fd, 1 << 16)
+        except BlockingIOError:
+            return
+        except OSError:
+            # e.g. EIO once the other end of a pty has been closed
+            data = b''
+        if len(data) == 0:
+            self.eof = True
+            asyncio.get_running_loop().remove_reader(fd)
+        else:
+            self.buffer += data
+            self.nBytes += len(data)
+            self.maxBuffered = max(self.maxBuffered, len(self.buffer))
+        self.dataAvailable.set()
+
+    async def decodeBuffered(self, queue):
+        while True:
+            await self.dataAvailable.wait()
+            self.dataAvailable.clear()
+
+            # the input may end while we wait for the consumer below, stop
+            # only once the buffer was taken after the end was seen
+            eof = self.eof
+
+            if self.binary:
+                # take all complete frames (everything once the input ended)
+                tagData, tagIds, end, nBadFrames = MicrotagDecoder.decodeFrames(
+                        bytes(self.buffer), eof)
+                del self.buffer[:end]
+                self.nBadFrames += nBadFrames
+            else:
+                # take all complete lines (everything once the input ended)
+                end = len(self.buffer) if eof else self.buffer.rfind(b'\n') + 1
+                buffer = bytes(self.buffer[:end])
+                del self.buffer[:end]
+                tagData, tagIds = self.extractor.extract(buffer)
+
+            if len(tagData) > 0:
+                # blocks while the consumer is behind
+                await queue.put(self.analyser.analyseBlock(tagData, tagIds))
+
+            if eof:
+                await queue.put(None)
+                return
+
+    async def iterChunks(self):
+        # asynchronously yields analysed MicrotagChunks until the input ends
+        import asyncio
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self.queueSize)
+        self.dataAvailable = asyncio.Event()
+
+        fd = await self.openDevice()
+        loop.add_reader(fd, self.onReadable, fd)
+        decoder = loop.create_task(self.decodeBuffered(queue))
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            if not self.eof:
+                loop.remove_reader(fd)
+            decoder.cancel()
+            os.close(fd)
+
+
+#
+# _____________________________________________________________________________
+#
+async def runLive(microtags, device, baudRate, extractor, binary):
+
+    import asyncio
+    loop = asyncio.get_running_loop()
+
+    def write(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    reader = MicrotagLiveReader(microtags.tagDefDict, device, baudRate,
+            extractor=extractor, binary=binary)
+    async for chunk in reader.iterChunks():
+        lines = microtags.chunkToLines(chunk, reader.getAliases())
+        if len(lines) > 0:
+            # a slow terminal or pipe blocks a worker thread instead of the
+            # event loop, which keeps reading the device meanwhile
+            await loop.run_in_executor(None, write, '\n'.join(lines) + '\n')
+
+    print('Received {0} byte(s), {1} microtag(s), {2} {3}.'.format(
+            reader.getNumberOfBytes(), reader.getAnalyser().nTags,
+            reader.getNumberOfBadFrames() if binary else
+                    extractor.getNumberOfMalformedLines(),
+            'corrupted frame(s)' if binary else 'malformed line(s)'))
+
+
+#
+# _____________________________________________________________________________
+#
+def addInputArguments(parser):
+    parser.add_argument('--prefix', default=None,
+            help='find microtags after this prefix anywhere in a line')
+    parser.add_argument('--pattern', default=None,
+            help='regular expression with one group capturing a microtag')
+    parser.add_argument('--binary', action='store_true',
+            help='read frames of binary flushes instead of text')
+
+
+def addProfileArguments(parser):
+    parser.add_argument('--profile', action='store_true',
+            help='print time, throughput and memory per phase and counters')
+    parser.add_argument('--profile-json', default=None, metavar='FILE',
+            help='write the phase timing and counters as JSON')
+    parser.add_argument('--profile-hook', choices=MicrotagProfile.hooks,
+            default=None, help='run phases under cProfile or tracemalloc')
+    parser.add_argument('--profile-phase', action='append', default=None,
+            metavar='PHASE', help='phase to run under the hook, e.g. import, '
+                    'analyse or render (may be repeated, default: all)')
+    parser.add_argument('--profile-output', default=None, metavar='FILE',
+            help='save the cProfile statistics (e.g. for snakeviz)')
+
+
+def reportProfile(args, microtags, out=None):
+
+    # print and/or export the profile of a run (see addProfileArguments())
+
+    profile = microtags.getProfile()
+    if args.profile:
+        print('\n'.join(profile.toLines()), file=out)
+    if args.profile_hook is not None:
+        print(profile.getHookReport(), file=out)
+    if args.profile_json is not None:
+        profile.writeJson(args.profile_json)
+        print('Saved profile to {0}.'.format(args.profile_json), file=out)
+
+
+def runDecode(args):
+
+    # print raw microtags block by block (no tag definitions, no analysis)
+    n = 0
+    with MicrotagDecoder.openTrace(args.tagsFilename) as f:
+        if args.binary:
+            blocks = ((tagData, tagIds) for tagData, tagIds, nBadFrames in
+                    MicrotagDecoder.iterFrameBlocks(f))
+        else:
+            extractor = MicrotagExtractor(args.prefix, args.pattern)
+            blocks = (extractor.extract(buffer)
+                    for buffer in MicrotagDecoder.iterBuffers(f))
+        for tagData, tagIds in blocks:
+            if len(tagData) > 0:
+                print('\n'.join(['{0}: {1:04X}:{2:08X}'.format(i, tagId, data)
+                        for i, (data, tagId) in enumerate(zip(tagData, tagIds), n)]))
+            n += len(tagData)
+
+
+def runStats(args, microtags):
+
+    # summarise span durations of one or more trace files in a table
+    batch = MicrotagBatch(microtags.tagDefDict, args.workers, args.prefix,
+            args.pattern, args.group_by)
+    summaries = batch.run(args.tagsFilenames)
+    print('\n'.join(MicrotagBatch.summariesToLines(summaries, microtags.dataToTime)))
+    return summaries
+
+
+def runCompare(args, microtags, out):
+
+    # compare span durations of a candidate with a baseline trace, exiting
+    # with status 1 if any group regressed by more than the threshold
+    summaries = [MicrotagBatch.summariseFile(filename, microtags.tagDefDict,
+            args.prefix, args.pattern, args.group_by)
+            for filename in [args.baselineFilename, args.candidateFilename]]
+    for summary in summaries:
+        if summary['error'] is not None:
+            print("Failed to read/parse input file. Stopping.", file=out)
+            print(summary['error'], file=out)
+            sys.exit(2)
+
+    comparison = MicrotagComparison(summaries[0]['spans'], summaries[1]['spans'],
+            args.confidence, args.threshold / 100.)
+    if args.format == 'json':
+        print(json.dumps(comparison.toDict(), indent=4))
+    else:
+        print('\n'.join(comparison.toLines(microtags.dataToTime)))
+
+    if len(comparison.getRegressions()) > 0:
+        sys.exit(1)
+    return comparison
+
+
+def importTags(args, microtags, out=None):
+
+    # import (or load from the cache) and analyse the trace file, reporting
+    # to out (stdout by default)
+
+    try:
+        if args.cache is not None:
+            cache = MicrotagCache(args.cache or None, args.cache_size << 20)
+            n, hit = cache.importAndAnalyse(microtags, args.tagDefFilename,
+                    args.tagsFilename, args.prefix, args.pattern, args.workers,
+                    args.binary)
+            if hit:
+                print('Using cached analysis from {0}.'.format(cache.getDirectory()),
+                        file=out)
+        elif args.binary:
+            n = microtags.importTagsFromBinaryFile(args.tagsFilename)
+        elif args.workers > 1:
+            n = microtags.importTagsFromFileParallel(args.tagsFilename,
+                    args.workers, prefix=args.prefix, pattern=args.pattern)
+        else:
+            n = microtags.importTagsFromFile(args.tagsFilename,
+                    prefix=args.prefix, pattern=args.pattern)
+        print(('Imported {0} microtag(s).'.format(n)), file=out)
+        if microtags.getExtractor() is not None and \
+                microtags.getExtractor().getNumberOfMalformedLines() > 0:
+            print(('Skipped {0} malformed line(s).'.format(
+                    microtags.getExtractor().getNumberOfMalformedLines())), file=out)
+        if microtags.getNumberOfBadFrames() > 0:
+            print(('Skipped {0} corrupted frame(s).'.format(
+                    microtags.getNumberOfBadFrames())), file=out)
+    except Exception as e:
+        print("Failed to read/parse input file. Stopping.", file=out)
+        print(e, file=out)
+        return False
+
+    if args.cache is None and (args.binary or args.workers <= 1):
+        microtags.analyse()
+
+    return True
+
+
+def runAnalyse(args, microtags, out=None):
+
+    if args.live:
+        import asyncio
+        try:
+            asyncio.run(runLive(microtags, args.tagsFilename, args.baud,
+                    MicrotagExtractor(args.prefix, args.pattern), args.binary))
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print("Failed to read from device. Stopping.", file=out)
+            print(e, file=out)
+        return
+
+    if not importTags(args, microtags, out):
+        return
+
+    renderers = {'text': MicrotagTextRenderer, 'csv': MicrotagCsvRenderer,
+            'jsonl': MicrotagJsonRenderer}
+    f = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        if args.format == 'text':
+            useColor = args.color == 'always' or \
+                    (args.color == 'auto' and f.isatty())
+            renderer = MicrotagTextRenderer(f, useColor)
+        else:
+            renderer = renderers[args.format](f)
+        renderer.render(microtags)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+        else:
+            f.flush()
+
+    report = microtags.matchingReportStr()
+    if len(report) > 0:
+        print(report, file=out)
 
     return microtags
 
 
+def runFlame(args, microtags, out):
+
+    # aggregate the span call tree into folded stacks (or an indented tree)
+    if not importTags(args, microtags, out):
+        return
+
+    tree = microtags.getSpanTree()
+    f = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        if args.tree:
+            f.write('\n'.join(tree.treeToLines(microtags.dataToTime)) + '\n')
+        else:
+            tree.writeFolded(f)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+        else:
+            f.flush()
+
+    report = microtags.matchingReportStr()
+    if len(report) > 0:
+        print(report, file=out)
+
+    return tree
+
+
+def main(argv):
+
+    # Commands import only what they need: decode and analyse get by with
+    # the standard library (numpy is used for large inputs), live analysis
+    # loads asyncio, stats uses worker processes and plot loads matplotlib.
+
+    commands = ['decode', 'analyse', 'stats', 'flame', 'compare', 'plot']
+    if len(argv) == 0 or (argv[0] not in commands and argv[0] not in ['-h', '--help']):
+        # analyse is the default command
+        argv = ['analyse'] + list(argv)
+
+    if argv[0] == 'plot':
+        # plotting options may be mixed with those of analyse, so plotting.py
+        # parses all arguments itself
+        import plotting
+        return plotting.main(list(argv[1:]), prog='microtags.py plot')
+
+    parser = argparse.ArgumentParser(prog='microtags.py',
+            description='Decode and analyse microtags.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+
+    decodeParser = subparsers.add_parser('decode',
+            help='print raw microtags without analysing them')
+    decodeParser.add_argument('tagsFilename', metavar='tag-file',
+            help='trace file, may be compressed (- for stdin)')
+    addInputArguments(decodeParser)
+
+    analyseParser = subparsers.add_parser('analyse',
+            help='match spans and print all microtags (the default)')
+    analyseParser.add_argument('tagDefFilename', metavar='tag-def-file')
+    analyseParser.add_argument('tagsFilenames', metavar='tag-file', nargs='+',
+            help='trace file, may be compressed (- for stdin, or serial '
+                    'device, pty or FIFO with --live)')
+    addInputArguments(analyseParser)
+    analyseParser.add_argument('--live', action='store_true',
+            help='print spans, events and data while they arrive')
+    analyseParser.add_argument('--baud', type=int, default=None,
+            help='configure the serial device to this baud rate')
+    analyseParser.add_argument('--workers', type=int, default=1,
+            help='number of processes decoding and analysing the trace file')
+    analyseParser.add_argument('--format', choices=['text', 'csv', 'jsonl'],
+            default='text', help='output format of the analysed microtags')
+    analyseParser.add_argument('--color', choices=['always', 'auto', 'never'],
+            default='always', help='colour the text output (auto: on terminals)')
+    analyseParser.add_argument('--output', default=None, metavar='FILE',
+            help='write the analysed microtags to a file instead of stdout')
+    analyseParser.add_argument('--batch', action='store_true',
+            help='summarise all matching trace files (same as stats)')
+    analyseParser.add_argument('--cache', nargs='?', const='', default=None,
+            metavar='DIR', help='keep decoded and analysed traces in a cache '
+                    'directory (default: ~/.cache/microtags)')
+    analyseParser.add_argument('--cache-size', type=int, default=1024,
+            help='maximum size of the cache directory in MiB')
+
+    statsParser = subparsers.add_parser('stats',
+            help='summarise span durations of trace files in a table')
+    statsParser.add_argument('tagDefFilename', metavar='tag-def-file')
+    statsParser.add_argument('tagsFilenames', metavar='tag-file', nargs='+',
+            help='trace files or glob patterns of trace files (- for stdin)')
+    addInputArguments(statsParser)
+    statsParser.add_argument('--workers', type=int, default=1,
+            help='number of processes summarising trace files')
+
+    flameParser = subparsers.add_parser('flame',
+            help='aggregate nested spans into folded stacks for flame graphs')
+    flameParser.add_argument('tagDefFilename', metavar='tag-def-file')
+    flameParser.add_argument('tagsFilename', metavar='tag-file',
+            help='trace file, may be compressed (- for stdin)')
+    addInputArguments(flameParser)
+    flameParser.add_argument('--workers', type=int, default=1,
+            help='number of processes decoding and analysing the trace file')
+    flameParser.add_argument('--cache', nargs='?', const='', default=None,
+            metavar='DIR', help='keep decoded and analysed traces in a cache '
+                    'directory (default: ~/.cache/microtags)')
+    flameParser.add_argument('--cache-size', type=int, default=1024,
+            help='maximum size of the cache directory in MiB')
+    flameParser.add_argument('--clock', type=float, default=None,
+            metavar='HZ', help='tick frequency to present times in seconds '
+                    '(with --tree)')
+    flameParser.add_argument('--output', default=None, metavar='FILE',
+            help='write the folded stacks to a file instead of stdout')
+    flameParser.add_argument('--tree', action='store_true',
+            help='print count, total and self time per path as a tree')
+
+    for commandParser in [analyseParser, flameParser]:
+        addProfileArguments(commandParser)
+
+    compareParser = subparsers.add_parser('compare',
+            help='rank span duration changes between a baseline and a candidate')
+    compareParser.add_argument('tagDefFilename', metavar='tag-def-file')
+    compareParser.add_argument('baselineFilename', metavar='baseline-file')
+    compareParser.add_argument('candidateFilename', metavar='candidate-file')
+    addInputArguments(compareParser)
+    compareParser.add_argument('--threshold', type=float, default=5.,
+            metavar='PERCENT', help='slowdown of a group (at the confidence '
+                    'level) counted as regression, exit status 1 if any')
+    compareParser.add_argument('--confidence', type=float, default=0.95,
+            help='confidence level of the intervals of the differences')
+    compareParser.add_argument('--format', choices=['text', 'json'],
+            default='text', help='output format of the report')
+
+    for commandParser in [analyseParser, statsParser, compareParser]:
+        commandParser.add_argument('--clock', type=float, default=None,
+                metavar='HZ', help='tick frequency to present times in seconds')
+        commandParser.add_argument('--group-by', action='append', default=None,
+                metavar='ALIAS', help='group span statistics by the current '
+                        'value of this data tag (may be repeated)')
+
+    # only listed here, see plotting.main(...)
+    subparsers.add_parser('plot', add_help=False,
+            help='plot grouped span durations (see plotting.py)')
+
+    args = parser.parse_args(argv)
+
+    if getattr(args, 'pattern', None) is not None:
+        try:
+            MicrotagExtractor(args.prefix, args.pattern)
+        except (ValueError, re.error) as e:
+            subparsers.choices[args.command].error(
+                    'invalid --pattern: {0}'.format(e))
+
+    if args.command == 'decode':
+        return runDecode(args)
+
+    if args.command == 'analyse' and args.batch:
+        args.command = 'stats'
+    elif args.command == 'analyse' and len(args.tagsFilenames) != 1:
+        analyseParser.error('expecting a single tag file (or use stats)')
+    if args.command not in ['flame', 'compare']:
+        args.tagsFilename = args.tagsFilenames[0]
+
+    # folded stacks, CSV, JSON lines and JSON reports written to stdout are
+    # meant to be piped, so messages go to stderr then
+    out = sys.stderr if (args.command == 'flame' and args.output is None) or \
+            (args.command == 'analyse' and args.format != 'text' and
+                    args.output is None and not args.live) or \
+            (args.command == 'compare' and args.format == 'json') else sys.stdout
+
+    # read input file
+    microtags = MicrotagList(clockFrequency=args.clock)
+    if args.command not in ['stats', 'compare'] and args.profile_hook is not None:
+        microtags.getProfile().setHook(args.profile_hook, args.profile_phase,
+                args.profile_output)
+
+    try:
+        n = microtags.importTagDefsFromFile(args.tagDefFilename)
+        print(('Imported {0} microtag definition(s).'.format(n)), file=out)
+        for warning in microtags.getTagDefWarnings():
+            print('Warning: {0}.'.format(warning), file=out)
+    except Exception as e:
+        print("Failed to read/parse input file. Stopping.", file=out)
+        print(e, file=out)
+        return
+
+    if args.command == 'stats':
+        return runStats(args, microtags)
+
+    if args.command == 'compare':
+        return runCompare(args, microtags, out)
+
+    if args.command == 'flame':
+        result = runFlame(args, microtags, out)
+    else:
+        result = runAnalyse(args, microtags, out)
+
+    reportProfile(args, microtags, out)
+    return result
+
+
 #
 # _____________________________________________________________________________
 #
@@ -1,19 +1,93 @@
 #!/usr/bin/python3
 
+import os
 import sys
+import argparse
 import base64
 import binascii
 import microtags
-import matplotlib
-import math
-import numpy as np
-from scipy import optimize
 
 
 #
 # _____________________________________________________________________________
 #
-def main(argv):
+def decimate(X, Ys, nColumns):
+
+    # Returns the indices of the points to draw such that every pixel column
+    # keeps its first and last point as well as the smallest and largest
+    # point of each of the series Ys (X has to be sorted). The decimated
+    # plot looks the same as the full one at this resolution.
+
+    import numpy as np
+
+    if len(X) <= 4 * nColumns:
+        return np.arange(len(X))
+
+    span = X[-1] - X[0]
+    if span > 0:
+        columns = np.minimum(((X - X[0]) * (nColumns / span)).astype(np.int64),
+                nColumns - 1)
+    else:
+        columns = np.zeros(len(X), dtype=np.int64)
+
+    # first and last point per column
+    keep = [np.unique(columns, return_index=True)[1],
+            len(columns) - 1 - np.unique(columns[::-1], return_index=True)[1]]
+
+    # smallest and largest point per column (sorted by column, then value)
+    for Y in Ys:
+        order = np.lexsort((Y, columns))
+        firsts = np.flatnonzero(np.r_[True, np.diff(columns[order]) != 0])
+        lasts = np.r_[firsts[1:], len(order)] - 1
+        keep += [order[firsts], order[lasts]]
+
+    return np.unique(np.concatenate(keep))
+
+
+#
+# _____________________________________________________________________________
+#
+def fitLinear(X, Y):
+
+    # least-squares fit of y = m*x + c in closed form (centred for accuracy)
+    xMean = X.mean()
+    yMean = Y.mean()
+    dX = X - xMean
+    sxx = (dX * dX).sum()
+    m = (dX * (Y - yMean)).sum() / sxx if sxx > 0 else 0.
+    return m, yMean - m * xMean
+
+
+#
+# _____________________________________________________________________________
+#
+def main(argv, prog='plotting.py'):
+
+    # options of this script, all others are passed on to microtags
+    parser = argparse.ArgumentParser(prog=prog, add_help=False,
+            usage='%(prog)s [-h] [--groups GROUPS] [--output FILE] [--dpi DPI] '
+                    '[analyse options] tag-def-file tag-file',
+            description='Plot grouped span durations.',
+            epilog='All other options are those of "microtags.py analyse".')
+    parser.add_argument('-h', '--help', action='help',
+            help='show this help message and exit')
+    parser.add_argument('--groups', default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'example-groups.json'),
+            help='grouping configuration (JSON)')
+    parser.add_argument('--output', default=None, metavar='FILE',
+            help='render to a PNG or SVG file instead of showing the plot')
+    parser.add_argument('--dpi', type=float, default=None,
+            help='resolution of the rendered plot')
+    args, argv = parser.parse_known_args(argv)
+    grouping = microtags.MicrotagGrouping.fromFile(args.groups)
+
+    # matplotlib and numpy are imported only once the arguments are parsed
+    import matplotlib
+    import numpy as np
+
+    if args.output is not None:
+        # >>> render without a display >>>
+        matplotlib.use('Agg')
 
     import matplotlib.pyplot as plot
     globals()['plot'] = plot
@@ -25,125 +99,35 @@ def main(argv):
     #yScale = 1.
     #yLabel = 'Ticks'
 
-    stateTags = ['BenchNum', 'BenchSize', 'BenchRun', 'BenchVariant', 'ComprRounds', 'FinalRounds']
-    plotTags = ['Benchmark']
-
-    state = {}
-
-    # data: name -> (x value -> (Ysum, Ysum2, N))
-    data = {}
-
-    for tag in microtagList.analysedTags:
-
-        if isinstance(tag, microtags.MicrotagData):
-            if tag.getIdAlias() in stateTags:
-
-                if tag.getIdAlias() == 'BenchNum' and \
-                        state.get(tag.getIdAlias(), 0) > tag.getTagData():
-                    state['BenchNum_overflow'] = state.get('BenchNum_overflow', 0) + 1
-
-                state[tag.getIdAlias()] = tag.getTagData()                
-
-
-        if isinstance(tag, microtags.MicrotagStop):
-            if tag.getIdAlias() in plotTags:
-
-                stateVec = (state['BenchVariant'], state['BenchRun'])
-
-                if stateVec[0] == 0x10:
-                    name = 'HMAC-SHA256'
-                elif stateVec == (0x11, 0):
-                    name = 'HMAC-SHA256-initial-run'
-                elif stateVec[0] == 0x11 and stateVec[1] > 0:
-                    name = 'HMAC-SHA256-followup-run'
-                elif stateVec[0] == 0x20:
-                    name = 'AES-128-GMAC (AO)'
-                elif stateVec[0] == 0x21:
-                    name = 'AES-256-GMAC (AO)'
-                elif stateVec[0] == 0x28:
-                    name = 'AES-128-GCM (AE)'
-                elif stateVec[0] == 0x29:
-                    name = 'AES-256-GCM (AE)'
-                elif stateVec[0] == 0x30:
-                    name = 'ChaCha20-Poly1305 (AO)'
-                elif stateVec == (0x31, 0):
-                    name = 'ChaCha20-Poly1305-initial-run'
-                elif stateVec[0] == 0x31 and stateVec[1] > 0:
-                    name = 'ChaCha20-Poly1305-followup-run'
-                elif stateVec[0] == 0x38:
-                    name = 'ChaCha20-Poly1305 (AE)'
-                elif stateVec[0] == 0x40:
-                    name = 'SHA3'
-                elif stateVec[0] == 0x50:
-                    name = 'KMAC'
-                elif stateVec[0] == 0x60:
-                    name = 'SipHash-{}-{}-64'.format(state['ComprRounds'], state['FinalRounds'])
-                elif stateVec[0] == 0x61:
-                    name = 'SipHash-{}-{}-128'.format(state['ComprRounds'], state['FinalRounds'])
-                else:
-                    continue
-
-                x = state['BenchSize']
-                end_time = tag.getTagData()
-                start_time = microtagList.getAnalysedTags()[tag.getStartTagIndex()].getTagData()
-                if end_time >= start_time:
-                    y = end_time - start_time
-                else:
-                    y = (end_time + 0xFFFFFFFF) - start_time
-
-                if name in data:
-                    # >>> New point in existing dataset >>>
-                    if x in data[name]:
-                        # >>> New point at existing x value >>>
-                        data[name][x] = (
-                                data[name][x][0] + y, 
-                                data[name][x][1] + y**2, 
-                                data[name][x][2] + 1)
-                    else:
-                        # >>> New point at new x value >>>
-                        data[name][x] = (y, y**2, 1)
-                else:
-                    # >>> New point opens new dataset >>>
-                    data[name] = { x: (y, y**2, 1) }
+    # data: name -> (x value -> statistics of durations)
+    data = grouping.apply(microtagList)
+
+    # number of pixel columns available to draw a series
+    figure = plot.figure(dpi=args.dpi)
+    nColumns = int(figure.get_size_inches()[0] * figure.dpi)
 
     for name in data:
-        X = []
-        Y = []
-        Yvardown = []
-        Yvarup = []
-
-        for x in sorted(data[name].keys()):
-            ysum = data[name][x][0]
-            ysum2 = data[name][x][1]
-            n = data[name][x][2]
- 
-            y = ysum / n
-            yerr = math.sqrt( (ysum2 - ysum**2 / n) / (n - 1) ) if n > 1 else 0.
-
-            X += [x]
-            Y += [y * yScale]
-            Yvardown += [(y - yerr) * yScale]
-            Yvarup += [(y + yerr) * yScale]
 
-        print('Plotting {0} with {1} constribution(s)'.format(name, 
-                str(set([v[2] for v in data[name].values()]))))
+        stats = [(x, s) for x, s in data[name].items() if x is not None]
+        X = np.array([x for x, s in stats], dtype=float)
+        Y = np.array([s.getMean() for x, s in stats]) * yScale
+        Yerr = np.array([s.getStdDev() for x, s in stats]) * yScale
 
-        plot.scatter(X, Y, 2)
-        plot.plot(X, Y, label=name)
-        plot.fill_between(X, Yvardown, Yvarup, color='lightgrey')
+        print('Plotting {0} with {1} constribution(s)'.format(name, 
+                str(set([s.getCount() for x, s in stats]))))
 
-        if True:
-        
-            # Linear fit
-            B = lambda x, m, c: m*x + c
+        keep = decimate(X, [Y, Y - Yerr, Y + Yerr], nColumns)
+        plot.scatter(X[keep], Y[keep], 2)
+        plot.plot(X[keep], Y[keep], label=name)
+        plot.fill_between(X[keep], (Y - Yerr)[keep], (Y + Yerr)[keep],
+                color='lightgrey')
 
-            Xnp = np.array(X)
-            Ynp = np.array(Y)
+        if len(X) > 0:
 
-            #params = [max(Ymean), 1E-5]
-            params, params_covariance = optimize.curve_fit(B, X, Y, p0=[0., 0.])
+            # Linear fit (using all points)
+            m, c = fitLinear(X, Y)
 
-            print(' -> fit: m = {0:.2f} {1}/byte, c = {2:.2f}'.format(params[0], yLabel, params[1]))
+            print(' -> fit: m = {0:.2f} {1}/byte, c = {2:.2f}'.format(m, yLabel, c))
 
     plot.legend()
 
@@ -161,7 +145,11 @@ def main(argv):
     plot.minorticks_on()
     plot.title("ARM Cortex-M4, STM32F429 @100 MHz, mbedTLS 2.16.2")
 
-    plot.show()
+    if args.output is not None:
+        plot.savefig(args.output)
+        print('Saved plot to {0}.'.format(args.output))
+    else:
+        plot.show()
 
 
 #
@@ -169,4 +157,3 @@ def main(argv):
 #
 if __name__ == "__main__":
     main(sys.argv[1:]);
-